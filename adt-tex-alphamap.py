@@ -1,374 +1,364 @@
 import sys
 import os
-import struct
+import queue
+import signal
 import time
-import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from PIL import Image
+from alphamaps import AdtFile, AlphamapWriter, Manifest, MapIndex, MapMosaic, MpqChain, WdtFile, parse_adt_name
+from alphamaps.manifest import file_sha1
+from alphamaps.metrics import Metrics, write_metrics
+from alphamaps.output import OUTPUT_FORMATS, PNG_FILTERS
+from alphamaps.pipeline import run_pipeline
+from alphamaps.watch import FolderWatcher, WatchServer
 
 default_big_alpha = False
+writer_settings = {} # AlphamapWriter arguments, from the command line
+export_filters = {} # AdtFile.select() arguments : texture_patterns and chunk_rect, from the command line
+tile_rect = None # (min x, min y, max x, max y) of the ADTs to export
+alphamap_writer = None
+map_mosaics = {} # key = str map_name, value = MapMosaic, when exporting whole map mosaics
 map_definitions = {} # key = str map_name, value = bool big_alpha
 failed_adts_names = []
+default_index_path = os.path.join("output", "map_index.json")
+mpq_chain = None # MpqChain, when reading maps straight from the client archives
+mpq_maps = set() # maps whose ADTs are read from mpq_chain, their paths are names in the archives
+quiet = False # silence per file messages
+collect_metrics = False
 
-def parse_c_strings(data: bytes, encoding='utf-8') -> list[str]:
-    """Parse null-terminated strings from raw byte data."""
-    raw_strings = data.split(b'\x00')
-    strings = [s.decode(encoding) for s in raw_strings if s]
-    return strings
-
-def normalize_alpha(v):
-    return (v & 0xF) | ((v & 0xF) << 4)
+def log(message):
+    if not quiet:
+        print(message)
 
 def read_wdt_file(filepath):
-    print(f"\n--- Reading: {filepath} ---")
+    log(f"\n--- Reading: {filepath} ---")
     try:
-        with open(filepath, 'rb') as f:
-            map_name = os.path.splitext(os.path.basename(filepath))[0] 
-
-            # MVER
-            MVER_magic = f.read(4)
-            if (MVER_magic != b'REVM'):
-                print("Got MVER magic as '{}', expected 'REVM'.".format(MVER_magic))
-                return
-            MVER_size = f.read(4)
-            WDT_version = struct.unpack('I', f.read(4))[0]
-            req_wdt_version = 18
-            if (WDT_version != req_wdt_version):
-                print("Got WDT version '{}', expected '{}'.".format(WDT_version, req_wdt_version))
-                return
-            
-            # read chunks until we get MPHD chunk
-            while True:
-                magic = f.read(4)
-                size = struct.unpack('I', f.read(4))[0]
-
-                if magic == b'DHPM':
-                    assert size == 32, "Got unexpected WDT MPHD size"
-                    break
-                else:
-                    f.read(size)
+        wdt = WdtFile.from_file(filepath)
+        log(f"Map '{wdt.map_name}' definition found, uses big alpha : {wdt.big_alpha}")
 
-            # MPHD
-            flags = struct.unpack('I', f.read(4))[0]
-            adt_has_big_alpha = bool(flags & 0x04)
-
-            print(f"Map '{map_name}' definition found, uses big alpha : {adt_has_big_alpha}")
-
-            map_definitions[map_name] = adt_has_big_alpha
+        map_definitions[wdt.map_name] = wdt.big_alpha
 
     except Exception as e:
         print(f"Failed to read {filepath}: {e}")
 
 
-def read_adt_file(filepath):
-    print(f"\n--- Reading: {filepath} ---")
+def map_big_alpha(map_name):
+    return map_definitions.get(map_name, default_big_alpha)
+
+def output_settings():
+    # writer settings and filters changing the output files, recorded in the manifest
+    settings = {key: value for key, value in writer_settings.items() if key != "threads"}
+    settings.update((key, list(value)) for key, value in export_filters.items())
+    return settings
+
+def parse_rect(value, max_value):
+    """Parse 'min x,min y,max x,max y' with coordinates from 0 to max_value, return None if invalid."""
+    parts = value.split(",")
+    if len(parts) != 4 or not all(part.strip().isdigit() for part in parts):
+        return None
+    min_x, min_y, max_x, max_y = (int(part) for part in parts)
+    if min_x > max_x or min_y > max_y or max_x > max_value or max_y > max_value:
+        return None
+    return min_x, min_y, max_x, max_y
+
+def in_tile_rect(filepath):
+    if tile_rect is None:
+        return True
     try:
-    # if True:
-        with open(filepath, 'rb') as f:
-
-            filename = os.path.splitext(os.path.basename(filepath))[0] # Azeroth_33_55
-            parts = filename.split('_')  # ['Azeroth', '33', '55']
-            map_name = str(parts[0])
-            Adt_indexX = int(parts[1])
-            Adt_indexY = int(parts[2])
-
-            global default_big_alpha
-            big_alpha = default_big_alpha
-            alphamap_size = 4096 if big_alpha else 2048
-            
-            global map_definitions
-            if map_name in map_definitions:
-                print("Reading map as Big Alpha from WDT.")
-                big_alpha = map_definitions.get(map_name)
-            else:
-                print(f"WARNING : No WDT was given for map {map_name}, using Big alpha = {big_alpha}.")
-                print("You can change this by dropping a WDT file or using -bigalpha argument to force big alpha.")
-            
-            # MVER
-            MVER_magic = f.read(4)
-            if (MVER_magic != b'REVM'):
-                print("Got MVER magic as '{}', expected 'REVM'.".format(MVER_magic))
-                return
-            MVER_size = f.read(4)
-            ADT_version = struct.unpack('I', f.read(4))[0]
-            req_adt_version = 18
-            if (ADT_version != req_adt_version):
-                print("Got ADT version '{}', expected '{}'.".format(ADT_version, req_adt_version))
-                return
-
-            # MHDR
-            MHDR_magic = f.read(4)
-            if (MHDR_magic != b'RDHM'):
-                print("Got MHDR magic as '{}', expected 'RDHM'.".format(MHDR_magic))
-                return
-            mhdr_size = struct.unpack('I', f.read(4))[0] # should be 64
+        map_name, x, y = parse_adt_name(filepath)
+    except (ValueError, IndexError):
+        return True # not named like an ADT, will be reported as failed
+    min_x, min_y, max_x, max_y = tile_rect
+    return min_x <= x <= max_x and min_y <= y <= max_y
+
+def map_export_root(map_name):
+    # texture and chunk filtered exports get their own folder and manifest, a full export of the map is left as is.
+    # -tiles writes complete ADTs, it updates the full export (and mosaic) of the ADTs in range
+    if export_filters:
+        return os.path.join("output", map_name, "filtered")
+    return os.path.join("output", map_name)
+
+def map_output_root(map_name):
+    if map_name in map_mosaics:
+        return map_mosaics[map_name].output_root
+    return map_export_root(map_name)
+
+def adt_failed(job, e):
+    log(f"Failed to read {job['filepath']}: {e}")
+    metrics = job["metrics"]
+    filename = os.path.splitext(os.path.basename(job["filepath"]))[0]
+    if metrics is not None:
+        metrics.fail(filename, e)
+    failed_adts_names.append(filename)
+    job["failed"] = True
+    return job
+
+# an ADT export goes through read_adt_job, decode_adt_job and write_adt_job, one after the other
+# or as the stages of a pipeline. Each stage passes on a job dict, the result once finished.
+def read_adt_job(filepath):
+    """Read the source of an ADT, return its job : filepath, elapsed seconds, failed, outputs, source stat, sha1, metrics, data and adt."""
+    metrics = Metrics() if collect_metrics else None
+    job = {"filepath": filepath, "elapsed": 0.0, "failed": False, "outputs": [], "stat": None, "sha1": None,
+           "metrics": metrics, "data": None, "adt": None}
+    start_time = time.time()
+    try:
+        map_name = parse_adt_name(filepath)[0]
+        read_start_time = time.perf_counter()
+        # size and mtime are taken before reading, a save during the read then
+        # leaves an older mtime in the manifest and the next run compares content
+        if map_name in mpq_maps:
+            stat = mpq_chain.stat(filepath)
+            data = mpq_chain.read_file(filepath)
+        else:
+            with open(filepath, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                data = f.read()
+        if metrics is not None:
+            metrics.add("read", time.perf_counter() - read_start_time, len(data))
+            metrics.count("adts")
+        job["data"] = data
+        job["stat"] = (stat.st_size, stat.st_mtime_ns)
+        job["sha1"] = file_sha1(data)
+    except Exception as e:
+        adt_failed(job, e)
+    job["elapsed"] += time.time() - start_time
+    return job
+
+def decode_adt_job(job):
+    """Parse and decode the alphamaps of a read ADT."""
+    if job["failed"]:
+        return job
+    filepath = job["filepath"]
+    metrics = job["metrics"]
+    start_time = time.time()
+    log(f"\n--- Reading: {filepath} ---")
+    try:
+        map_name, Adt_indexX, Adt_indexY = parse_adt_name(filepath)
 
-            MHDR_data_offset = 20 # where MHDR data starts (mhdr_flags)
+        big_alpha = map_big_alpha(map_name)
+        
+        if map_name in map_definitions:
+            log("Reading map as Big Alpha from WDT.")
+        else:
+            log(f"WARNING : No WDT was given for map {map_name}, using Big alpha = {big_alpha}.")
+            log("You can change this by dropping a WDT file, indexing the client folder with -buildindex or using -bigalpha argument to force big alpha.")
 
-            mhdr_flags = struct.unpack('I', f.read(4))[0]
-            # offset are relative to MHDR_data_offset
-            MCIN_offset = struct.unpack('I', f.read(4))[0]
-            MTEX_offset = struct.unpack('I', f.read(4))[0]
+        adt = AdtFile(job["data"], map_name, Adt_indexX, Adt_indexY, big_alpha, metrics)
+        if export_filters:
+            adt.select(**export_filters)
 
-            # read textures array
-            f.seek(MHDR_data_offset + MTEX_offset)
-            MTEX_magic = f.read(4)
-            if (MTEX_magic != b'XETM'):
-                print("Got MTEX magic as '{}', expected 'XETM'.".format(MTEX_magic))
-                return
-            MTEX_size = struct.unpack('I', f.read(4))[0]
-            MTEX_data = f.read(MTEX_size)
+        Num_textures = len(adt.textures)
+        log(f"ADT has {Num_textures} textures.")
 
-            MTEX_strings = parse_c_strings(MTEX_data)
+        if (Num_textures < 1):
+            log("ADT has no textures, skipping.")
+        else:
+            adt.decode_alphamaps()
+            if metrics is not None:
+                metrics.count("textures", Num_textures)
+            job["adt"] = adt
+        job["data"] = None # kept by the AdtFile while needed
 
-            Num_textures = len(MTEX_strings)
-            print(f"ADT has {Num_textures} textures.")
-            # print(MTEX_strings)
+    except Exception as e:
+        adt_failed(job, e)
+    job["elapsed"] += time.time() - start_time
+    return job
+
+def write_adt_job(job):
+    """Write the alphamaps of a decoded ADT, or add them to its map's mosaic."""
+    adt = job["adt"]
+    if job["failed"] or adt is None:
+        return job
+    metrics = job["metrics"]
+    start_time = time.time()
+    try:
+        if adt.map_name in map_mosaics:
+            if metrics is not None:
+                with metrics.stage("mosaic"):
+                    map_mosaics[adt.map_name].add_adt(adt)
+            else:
+                map_mosaics[adt.map_name].add_adt(adt)
+        else:
+            output_root = map_export_root(adt.map_name)
+            job["outputs"] = alphamap_writer.write(adt, output_root, metrics)
+    except Exception as e:
+        adt_failed(job, e)
+    job["adt"] = None
+    job["elapsed"] += time.time() - start_time
+    return job
+
+def job_result(job):
+    """Result dict of a finished job, as returned to the main process : filepath, elapsed seconds, failed, outputs, source stat, sha1 and metrics."""
+    metrics = job["metrics"]
+    return {"filepath": job["filepath"], "elapsed": job["elapsed"], "failed": job["failed"], "outputs": job["outputs"],
+            "stat": job["stat"], "sha1": job["sha1"], "metrics": metrics.as_dict() if metrics is not None else None}
+
+def process_adt_file(filepath):
+    """Read, decode and write one ADT, return its result dict."""
+    return job_result(write_adt_job(decode_adt_job(read_adt_job(filepath))))
+
+def pipeline_adt_files(filepaths, prefetch_depth, encode_depth):
+    """Yield the result dicts of ADTs read ahead, decoded and written by three threads at once."""
+    stages = [read_adt_job, decode_adt_job, write_adt_job]
+    # decoded ADTs hold their layers stack, keep few of them waiting
+    for job in run_pipeline(filepaths, stages, [prefetch_depth, encode_depth, encode_depth]):
+        yield job_result(job)
+
+
+def init_worker(definitions, big_alpha, settings, filters, mosaics_args, quiet_logs, metrics_enabled, chain, chain_maps):
+    # WDT flags and MPQ tables are resolved once in the main process and handed to each worker
+    global map_definitions, default_big_alpha, writer_settings, alphamap_writer, map_mosaics, quiet, collect_metrics
+    global mpq_chain, mpq_maps, export_filters
+    export_filters = filters
+    mpq_chain = chain
+    mpq_maps = chain_maps
+    quiet = quiet_logs
+    collect_metrics = metrics_enabled
+    map_definitions = definitions
+    default_big_alpha = big_alpha
+    writer_settings = settings
+    alphamap_writer = AlphamapWriter(**writer_settings)
+    map_mosaics = {map_name: MapMosaic(*args) for map_name, args in mosaics_args.items()}
+
+def init_watch_worker(*args):
+    # Ctrl+C stops the watch loop, which then shuts the workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_worker(*args)
+
+def warm_up_worker():
+    return os.getpid()
+
+def start_worker_pool(jobs):
+    # started and warmed before the first save, so exports don't pay the process startup
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=init_watch_worker,
+                                   initargs=(map_definitions, default_big_alpha, writer_settings, export_filters, {},
+                                             quiet, False, mpq_chain, mpq_maps))
+    for future in [executor.submit(warm_up_worker) for _ in range(jobs)]:
+        future.result()
+    return executor
+
+def export_batch(filepaths, executor, manifests, force_export):
+    """Export the given ADTs of the watch mode, reading the given WDTs first. Return (exported ADT names, failed ADT names)."""
+    for filepath in filepaths:
+        if filepath.lower().endswith(".wdt") and os.path.isfile(filepath):
+            read_wdt_file(filepath)
 
-            if (Num_textures < 1):
-                print("ADT has no textures, skipping.")
-                return
-            
-            # setup alphamap images for each texture ###########
-            width, height = 1024, 1024 # 64 * 16
-
-            # images = []
-            # images_pixels = []
-
-            alphamaps_arrays = []
-            # map images to memory by texture id
-            for texture in MTEX_strings:
-                alphamaps_arrays.append(np.full((1024, 1024), 0, dtype=np.uint8))
-
-            # read MCIN
-            f.seek(MHDR_data_offset + MCIN_offset)
-            MCIN_magic = f.read(4)
-            if (MCIN_magic != b'NICM'):
-                print("Got MCIN magic as '{}', expected 'NICM'.".format(MCIN_magic))
-                return
-            MCIN_size = struct.unpack('I', f.read(4))[0] # should be 4096
-
-            # offset+size
-            mcnk_offsets: list[list[tuple[int, int]]] = [[(0, 0) for _ in range(16)] for _ in range(16)]
-
-            for y in range(16):
-                for x in range(16):
-                    mcnk_offset = struct.unpack('I', f.read(4))[0]
-                    mcnk_size = struct.unpack('I', f.read(4))[0]
-                    f.read(8) # useless data
-
-                    mcnk_offsets[y][x] = (mcnk_offset, mcnk_size)
-
-            # print(mcnk_offsets)
-
-            generate_layer_0 = True
-
-            # read MCNKs
-            for mcnk_y in range(16):
-                for mcnk_x in range(16):
-                    
-                    # print(f"Parsing MCNK y:{mcnk_y},x:{mcnk_x}")
-
-                    MCNK_CHUNK_offset = mcnk_offsets[mcnk_y][mcnk_x][0]
-                    MCNK_CHUNK_size = mcnk_offsets[mcnk_y][mcnk_x][1]
-                    f.seek(MCNK_CHUNK_offset)
-
-                    MCNK_magic = f.read(4)
-                    if (MCNK_magic != b'KNCM'):
-                        print("Got MCNK magic as '{}', expected 'KNCM'.".format(MCNK_magic))
-                        return
-                    MCNK_size = struct.unpack('I', f.read(4))[0] # should be 4096
-                        
-                    assert MCNK_size == (MCNK_CHUNK_size - 8), f"MCNK size is wrong"
-
-                    MCNK_Flags = struct.unpack('I', f.read(4))[0]
-                    indexX = struct.unpack('I', f.read(4))[0]
-                    indexY = struct.unpack('I', f.read(4))[0]
-                    assert indexX == mcnk_x, "MCNK X index did not match loop"
-                    assert indexY == mcnk_y, "MCNK Y index did not match loop"
-                    num_layers = struct.unpack('I', f.read(4))[0]
-                    f.read(4) # doodads
-                    f.read(4) # ofsMCVT
-                    f.read(4) # ofsNormals
-                    offset_MCLY = struct.unpack('I', f.read(4))[0]
-                    f.read(4) # ofsMCRF
-                    offset_MCAL = struct.unpack('I', f.read(4))[0] #offset to magic, not data
-                    size_Alpha = struct.unpack('I', f.read(4))[0] # includes chunk header(magic+size). sum of data of all layers
-                    # print(size_Alpha)
-                    # ...
-
-                    do_not_fix_alpha_map = bool(MCNK_Flags & (1 << 15))
-                    # if (do_not_fix_alpha_map):
-                    #     print(f'MCNK has do_not_fix_alpha_map enabled')
-                    
-                    # MCLY
-                    f.seek(MCNK_CHUNK_offset + offset_MCLY)
-                    MCLY_magic = f.read(4)
-                    if (MCLY_magic != b'YLCM'):
-                        print("Got MCLY magic as '{}', expected 'YLCM'.".format(MCLY_magic))
-                        return
-                    MCLY_size = struct.unpack('I', f.read(4))[0]
-                    assert num_layers == (MCLY_size / 16), f"Unexpected MCLY size or layer count"
-
-
-                    y_tile_pos = 64 * indexY
-                    x_tile_pos = 64 * indexX
-
-                    layer0_tex_id = 0
-                    
-                    # layer0_alphamap_data = [255] * 4096 # initialize all to 255
-                    layer0_alphamap_data = np.full((64, 64), 255, dtype=np.uint8)
-
-                    f.seek(MCNK_CHUNK_offset + offset_MCLY + 8) # Skip magic + size
-                    layers_data = f.read(num_layers * 16)
-
-                    for layer_id in range(num_layers):
-                        start = layer_id * 16
-                        layer_entry = layers_data[start : start + 12]
-
-                        tex_id, flags, ofsalphamap = struct.unpack('3I', layer_entry)
-                        # tex_id = struct.unpack('I', f.read(4))[0]
-                        # # print(tex_id)
-                        # flags = struct.unpack('I', f.read(4))[0]
-                        # ofsalphamap = struct.unpack('I', f.read(4))[0]
-                        # f.read(4) # ground effect id
-
-                        use_alpha_map = bool(flags & 0x100)
-                        alpha_map_compressed  = bool(flags & 0x200)
-                        # print(f"use alpha : {use_alpha_map}")
-                        # print(f"alpha compressed : {alpha_map_compressed}")
-
-                        # assert tex_id < Num_textures, f"Error; MCLY tex id exceeded Num_textures"
-
-                        if layer_id == 0:
-                            layer0_tex_id = tex_id
-                            assert use_alpha_map == False, "Error, layer 0 should never have an alpha map" # only big alpha should be compressed
-                            continue
-
-                        ###################
-
-                        assert use_alpha_map == True, "Error, layer id > 0 doesn't use alphamap"
-
-                        # read alphamap (MCAL)
-                        if use_alpha_map:
-                            # print(f"Layer Id {layer_id}")
-                            if not alpha_map_compressed:
-                                assert (offset_MCAL + ofsalphamap + alphamap_size) <= (offset_MCAL + size_Alpha), f"Unexpected alphamap offset {offset_MCAL + ofsalphamap + alphamap_size} {offset_MCAL + size_Alpha} {alphamap_size} {size_Alpha}"
-
-                            f.seek(MCNK_CHUNK_offset + offset_MCAL + ofsalphamap + 8)
-                            #alphamap_data = []
-                            if not big_alpha:
-                                assert alpha_map_compressed == False, "Error, only big alpha can be compressed" # only big alpha should be compressed
-
-                                raw_alphamap_data = np.frombuffer(f.read(2048), dtype=np.uint8)
-
-                                low = ((raw_alphamap_data & 0x0F) << 4) | (raw_alphamap_data & 0x0F)
-                                high = ((raw_alphamap_data & 0xF0) >> 4) | (raw_alphamap_data & 0xF0)
-
-                                alphamap_data = np.empty(4096, dtype=np.uint8)
-                                alphamap_data[0::2] = low
-                                alphamap_data[1::2] = high
-
-                                if not do_not_fix_alpha_map: # fix alpha map
-                                    # for i in range(64):
-                                    #     alphamap_data[i * 64 + 63] = alphamap_data[i * 64 + 62]
-                                    #     alphamap_data[63 * 64 + i] = alphamap_data[62 * 64 + i]
-                                    # alphamap_data[63 * 64 + 63] = alphamap_data[62 * 64 + 62]
-                                    amap = amap.reshape(64, 64)
-                                    amap[:, 63] = amap[:, 62]
-                                    amap[63, :] = amap[62, :]
-                                    amap[63, 63] = amap[62, 62]
-                            else: #big alpha
-                                if not alpha_map_compressed:
-                                    # alphamap_data = f.read(alphamap_size)
-                                    # alphamap_data = list(alphamap_data) # each byte becomes an 8-bit int
-                                    alphamap_data = np.frombuffer(f.read(4096), dtype=np.uint8)
-                                else: # compressed
-                                    # print("Compressed alphamap!")
-                                    raw_alphamap_data = []
-                                    while len(raw_alphamap_data) < 4096:
-                                        cmd_byte = f.read(1)
-                                        if not cmd_byte:
-                                            raise EOFError("Unexpected end of file while decoding alpha map")
-                                        
-                                        cmd = cmd_byte[0]
-                                        fill_mode = (cmd & 0x80) != 0  # in the first bit of that byte (sign bit) check if it's true. When true that means we are in "fill" mode, if false, "copy" mode
-                                        count = cmd & 0x7F  # the next 7 bits of the byte determine how many times we "fill" or "copy" (count) (eg, max value 127 - actually 64, see notes)
-
-                                        if fill_mode:
-                                            fill_byte = f.read(1)
-                                            raw_alphamap_data.extend([fill_byte[0]] * count) # converts the byte to int
-                                        else: # copy mode
-                                            copy_bytes = f.read(count)
-                                            raw_alphamap_data.extend(copy_bytes[i] for i in range(count))
-
-                                    # apparently blizz alphamaps can be bugged and have more than 4096, just ignore extra bytes
-                                    assert len(raw_alphamap_data) >= 4096, f"Error uncompressing alphamap, not enough  bytes {len(alphamap_data)}"
-
-                                    alphamap_data = np.array(raw_alphamap_data, dtype=np.uint8)
-
-                            # print(alphamap_data)
-
-                            # if (do_not_fix_alpha_map):
-                                # test alpha_map[x][63] == alpha_map[x][62]
-                                # TODO
-                                # assert alphamap_data[62] == alphamap_data[63], f"Error, do_not_fix_alpha_map flag but rows did not match : got {alphamap_data[62]} and {alphamap_data[63]}" 
-
-                            # alphamap_data = alphamap_data.astype(np.int16) # for safe substraction
-                            alphamap_data = alphamap_data.reshape((64, 64))
-
-                            alphamaps_arrays[tex_id][
-                                y_tile_pos : y_tile_pos + 64,
-                                x_tile_pos : x_tile_pos + 64
-                            ] = alphamap_data
-
-                            # update layer 0
-                            if (generate_layer_0):
-                                # layer0_alphamap_data -= alphamap_data
-                                layer0_alphamap_data = np.maximum(layer0_alphamap_data - alphamap_data, 0)
-
-                                # for alpha_i in range(4096):
-
-                                    # if (alpha_i == 23 and indexX==0 and indexY==0):
-                                    #     print(alphamap_data[alpha_i]) # debug
-
-                                    # print(layer0_alphamap_data[alpha_i])
-                                    # layer0_alphamap_data[alpha_i] -= alphamap_data[alpha_i]
-
-                                    # TODO, some bits add up to more than 255 total, investigate if it's normal or not
-                                    #assert layer0_alphamap_data[alpha_i] >= 0, f"Error; got negative alpha value for layer 0 : {layer0_alphamap_data[alpha_i]} {alphamap_data[alpha_i] } index {alpha_i} in layer {layer_id}"
-
-
-                    # Finally Update layer 0 texture
-                    # print(f"Layer 0 tex id : {layer0_tex_id}")
-                    if generate_layer_0:
-
-                        # TODO : construct whole array in numpy instead and generate once
-                        alphamaps_arrays[layer0_tex_id][
-                            y_tile_pos : y_tile_pos + 64,
-                            x_tile_pos : x_tile_pos + 64
-                        ] = layer0_alphamap_data  # already 64x64
-
-            output_root = os.path.join("output", map_name)
-            # for i, img in enumerate(images):
-            for i, arr in enumerate(alphamaps_arrays):
-                tex_name = MTEX_strings[i]
-                filename = os.path.basename(tex_name)
-                basename = os.path.splitext(filename)[0]
-
-                save_name = f"{map_name}_{Adt_indexX}_{Adt_indexY}-{basename}.png"
-                # output_path = "output\\" + map_name + "\\" + save_name
-                output_path = os.path.join(output_root, save_name)
-
-                os.makedirs(output_root, exist_ok=True)
-                img = Image.fromarray(arr, mode="L")
-                img.save(output_path)
+    adt_files = []
+    adt_maps = {} # key = str filepath, value = str map_name
+    for filepath in filepaths:
+        if not filepath.lower().endswith(".adt") or not os.path.isfile(filepath) or not in_tile_rect(filepath):
+            continue
+        try:
+            map_name = parse_adt_name(filepath)[0]
+        except (ValueError, IndexError):
+            adt_files.append(filepath) # will be reported as failed
+            continue
+        if map_name not in manifests:
+            manifests[map_name] = Manifest(map_output_root(map_name))
+        if not force_export and manifests[map_name].is_up_to_date(filepath, map_big_alpha(map_name), output_settings()):
+            log(f"{os.path.basename(filepath)} did not change, skipping.")
+            continue
+        adt_maps[filepath] = map_name
+        adt_files.append(filepath)
+
+    results = executor.map(process_adt_file, adt_files) if executor is not None else map(process_adt_file, adt_files)
+
+    exported_names = []
+    failed_names = []
+    removed_count = 0
+    for result in results:
+        name = os.path.splitext(os.path.basename(result["filepath"]))[0]
+        map_name = adt_maps.get(result["filepath"])
+        if result["failed"] or map_name is None:
+            failed_names.append(name)
+            continue
+        exported_names.append(name)
+        removed_outputs = manifests[map_name].update(result["filepath"], result["stat"], result["sha1"], map_big_alpha(map_name),
+                                                     output_settings(), result["outputs"], prune=not export_filters)
+        for output_path in removed_outputs:
+            log(f"Removed stale output: {output_path}")
+        removed_count += len(removed_outputs)
+    for manifest in manifests.values():
+        manifest.save()
+    if removed_count > 0:
+        print(f"Removed {removed_count} stale outputs.")
+    return exported_names, failed_names
+
+def watch(watcher, jobs, port):
+    """Export the watched ADTs again each time they are saved, until Ctrl+C."""
+    global alphamap_writer
+    server = None
+    if port is not None:
+        try:
+            server = WatchServer(port, watcher.resolve)
+        except OSError as e:
+            print(f"Failed to listen on port {port}: {e}")
+            return
+        server.start()
+        print(f"Status on GET {server.address}/status, trigger exports with POST {server.address}/export")
+
+    alphamap_writer = AlphamapWriter(**writer_settings)
+    executor = start_worker_pool(jobs) if jobs > 1 else None
+    manifests = {} # key = str map_name, value = Manifest
+    exports_count = 0
+    exported_count = 0
+    print(f"Watching {len(watcher.paths)} input paths for saved ADT and WDT files, press Ctrl+C to stop.")
+
+    def update_status(state, **values):
+        if server is not None:
+            server.update_status(state=state, watching=watcher.paths, watched_files=len(watcher.signatures),
+                                 pending_files=len(watcher.pending), exports=exports_count, exported_adts=exported_count, **values)
 
-    except Exception as e:
-        print(f"Failed to read {filepath}: {e}")
-        global failed_adts_names
-        filename = os.path.splitext(os.path.basename(filepath))[0]
-        failed_adts_names.append(filename)
+    try:
+        update_status("idle")
+        while True:
+            force_export = False
+            trigger = None
+            if server is not None:
+                try:
+                    trigger = server.triggers.get(timeout=watcher.interval)
+                except queue.Empty:
+                    pass
+            else:
+                time.sleep(watcher.interval)
+
+            filepaths = watcher.poll()
+            if trigger is not None:
+                paths, force_export = trigger
+                filepaths = sorted(set(filepaths) | set(paths or watcher.files()),
+                                   key=lambda filepath: (not filepath.lower().endswith(".wdt"), filepath))
+            if not filepaths:
+                update_status("idle")
+                continue
+
+            update_status("exporting", exporting=len(filepaths))
+            start_time = time.time()
+            wdt_changed = any(filepath.lower().endswith(".wdt") for filepath in filepaths)
+            if wdt_changed and executor is not None:
+                # workers have the map definitions they were started with
+                executor.shutdown()
+                executor = None
+            exported_names, failed_names = export_batch(filepaths, executor, manifests, force_export)
+            if wdt_changed and jobs > 1:
+                executor = start_worker_pool(jobs)
+            elapsed = time.time() - start_time
+
+            exports_count += 1
+            exported_count += len(exported_names)
+            if exported_names or failed_names:
+                print(f"[{time.strftime('%H:%M:%S')}] Exported {len(exported_names)} ADTs in {elapsed:.2f} seconds: {', '.join(exported_names)}")
+            if failed_names:
+                print(f"Failed to process {len(failed_names)} ADTs: {failed_names}")
+            update_status("idle", exporting=0, last_export={"time": time.strftime('%Y-%m-%d %H:%M:%S'), "seconds": round(elapsed, 3),
+                                                            "exported": exported_names, "failed": failed_names})
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        alphamap_writer.close()
+        if server is not None:
+            server.close()
 
 
 def main():
@@ -378,15 +368,29 @@ def main():
     
     start_time = time.time()
     
-    global default_big_alpha
-
-    got_wdt = False
+    global default_big_alpha, alphamap_writer, quiet, collect_metrics, mpq_chain, tile_rect
+
+    jobs = 1
+    prefetch_depth = 4 # ADTs read ahead of the decoding, 0 reads, decodes and writes one ADT at a time
+    encode_depth = 2 # decoded ADTs waiting to be written
+    force_export = False
+    mosaic_tile_size = None # tile size when exporting whole map mosaics
+    metrics_path = None
+    index_path = None # map index to load, -index or the default one
+    index_root = None # client folder to index
+    map_names = [] # maps to export from the index or the MPQ archives
+    mpq_paths = [] # archives, or folders of archives
+    watch_mode = False
+    watch_port = None # local http endpoint of the watch mode
+    watch_paths = [] # folders and files given, watched for changes in watch mode
 
     files_list = []
 
-    for arg  in sys.argv[1:]:
+    args = iter(sys.argv[1:])
+    for arg in args:
         # extract filepaths from folders
         if os.path.isdir(arg):
+            watch_paths.append(arg)
             for root, dirs, files in os.walk(arg):
                 for filename in files:
                     filepath = os.path.join(root, filename)
@@ -394,13 +398,179 @@ def main():
 
         elif arg == "-bigalpha":
             default_big_alpha = True
+        elif arg == "-quiet":
+            quiet = True
+        elif arg == "-metrics":
+            metrics_path = next(args, "")
+            if not metrics_path.lower().endswith((".json", ".csv")):
+                print(f"Command [-metrics] expects a .json or .csv output file, got '{metrics_path}'.")
+                return
+            collect_metrics = True
+        elif arg == "-mpq":
+            value = next(args, "")
+            if not os.path.exists(value):
+                print(f"Command [-mpq] expects an MPQ archive or a folder of archives, got '{value}'.")
+                return
+            mpq_paths.append(value)
+        elif arg in ("-index", "-buildindex", "-map"):
+            value = next(args, "")
+            if not value:
+                print(f"Command [{arg}] expects a value.")
+                return
+            if arg == "-index":
+                index_path = value
+            elif arg == "-buildindex":
+                if not os.path.isdir(value):
+                    print(f"Command [-buildindex] expects a folder, got '{value}'.")
+                    return
+                index_root = value
+            else:
+                map_names.append(value)
+        elif arg == "-textures":
+            patterns = [pattern for pattern in next(args, "").split(",") if pattern]
+            if not patterns:
+                print("Command [-textures] expects texture path patterns, e.g. '*grass*,tileset/elwynn/*'.")
+                return
+            export_filters["texture_patterns"] = export_filters.get("texture_patterns", []) + patterns
+        elif arg in ("-tiles", "-chunks"):
+            value = next(args, "")
+            rect = parse_rect(value, 63 if arg == "-tiles" else 15)
+            if rect is None:
+                print(f"Command [{arg}] expects min x,min y,max x,max y from 0 to {63 if arg == '-tiles' else 15}, got '{value}'.")
+                return
+            if arg == "-tiles":
+                tile_rect = rect
+            else:
+                export_filters["chunk_rect"] = rect
+        elif arg == "-watch":
+            watch_mode = True
+        elif arg == "-force":
+            force_export = True
+        elif arg == "-skipunused":
+            writer_settings["skip_unreferenced"] = True
+        elif arg in ("-jobs", "-threads", "-pnglevel", "-mosaic", "-watchport", "-prefetch", "-encodequeue"):
+            value = next(args, "")
+            if not value.isdigit():
+                print(f"Command [{arg}] expects a number, got '{value}'.")
+                return
+            if arg == "-jobs":
+                jobs = int(value) or (os.cpu_count() or 1) # -jobs 0 uses every core
+            elif arg == "-mosaic":
+                mosaic_tile_size = int(value)
+                if mosaic_tile_size < 2 or mosaic_tile_size % 2:
+                    print(f"Command [-mosaic] expects an even tile size, got '{value}'.")
+                    return
+            elif arg == "-prefetch":
+                prefetch_depth = int(value)
+            elif arg == "-encodequeue":
+                encode_depth = max(1, int(value))
+            elif arg == "-watchport":
+                watch_mode = True
+                watch_port = int(value)
+            elif arg == "-threads":
+                writer_settings["threads"] = int(value) or (os.cpu_count() or 1)
+            else:
+                writer_settings["compress_level"] = min(int(value), 9)
+        elif arg == "-format":
+            value = next(args, "")
+            if value not in OUTPUT_FORMATS:
+                print(f"Command [-format] expects one of {', '.join(OUTPUT_FORMATS)}, got '{value}'.")
+                return
+            writer_settings["output_format"] = value
+        elif arg == "-pngfilter":
+            value = next(args, "")
+            if value not in PNG_FILTERS:
+                print(f"Command [-pngfilter] expects one of {', '.join(PNG_FILTERS)}, got '{value}'.")
+                return
+            writer_settings["png_filter"] = value
         else:
             files_list.append(arg)
+            if arg.lower().endswith((".adt", ".wdt")):
+                watch_paths.append(arg)
+
+    if watch_mode:
+        if mosaic_tile_size is not None:
+            print("Command [-watch] can't be used with [-mosaic], mosaic tiles are written for whole maps.")
+            return
+        if not watch_paths:
+            print("Command [-watch] expects ADT or WDT files or folders to watch.")
+            return
     
     if default_big_alpha:
-        print("Command [-bigalpha] given, big alpha will be used as default.")
+        log("Command [-bigalpha] given, big alpha will be used as default.")
+    else:
+        log("Command [-bigalpha] not given, small alpha will be used as default.")
+
+    # dropped archives are read like -mpq ones
+    mpq_paths += [filepath for filepath in files_list if filepath.lower().endswith(".mpq")]
+    files_list = [filepath for filepath in files_list if not filepath.lower().endswith(".mpq")]
+    mpq_adt_files = []
+    if mpq_paths:
+        if not map_names:
+            print("MPQ archives given without a map, add -map NAME to choose the map to export.")
+            return
+        mpq_start_time = time.time()
+        archive_paths = []
+        for path in mpq_paths:
+            if os.path.isdir(path):
+                archive_paths += [os.path.join(root, filename) for root, dirs, files in os.walk(path)
+                                  for filename in files if filename.lower().endswith(".mpq")]
+            else:
+                archive_paths.append(path)
+        try:
+            mpq_chain = MpqChain.from_paths(archive_paths)
+        except Exception as e:
+            print(f"Failed to open MPQ archives: {e}")
+            return
+        log(f"Opened {len(mpq_chain.archives)} MPQ archives in {time.time() - mpq_start_time:.2f} seconds, by priority :")
+        for archive in reversed(mpq_chain.archives):
+            log(f"    {archive.path}")
+
+        for map_name in map_names:
+            # the client finds files without case, so the map name is used as given
+            wdt_name = f"World/Maps/{map_name}/{map_name}.wdt"
+            try:
+                wdt = WdtFile(mpq_chain.read_file(wdt_name), map_name)
+            except Exception as e:
+                print(f"Failed to read map '{map_name}' from the MPQ archives: {e}")
+                return
+            map_definitions[map_name] = wdt.big_alpha
+            mpq_maps.add(map_name)
+            adt_names = [f"World/Maps/{map_name}/{map_name}_{x}_{y}.adt" for x, y in wdt.adt_coords]
+            adt_names = [adt_name for adt_name in adt_names if mpq_chain.has_file(adt_name)]
+            log(f"Map '{map_name}' has {len(adt_names)} ADTs in the MPQ archives, uses big alpha : {wdt.big_alpha}")
+            mpq_adt_files += adt_names
+        map_names = [] # not looked up in the index
+
+    if index_root is not None:
+        index_start_time = time.time()
+        map_index = MapIndex(index_path or default_index_path)
+        map_count = map_index.build(index_root, lambda filepath, e: print(f"Failed to read {filepath}: {e}"))
+        map_index.save()
+        adt_count = sum(len(entry["adts"]) for entry in map_index.maps.values())
+        print(f"Indexed {map_count} maps and {adt_count} ADTs of {index_root} in {time.time() - index_start_time:.2f} seconds, saved to {map_index.path}")
+    elif index_path is not None or map_names or (mpq_chain is None and os.path.isfile(default_index_path)):
+        try:
+            map_index = MapIndex.load(index_path or default_index_path)
+        except (OSError, ValueError) as e:
+            print(f"Failed to read map index: {e}")
+            print("Build it first with -buildindex <client folder>.")
+            return
     else:
-        print("Command [-bigalpha] not given, small alpha will be used as default.")
+        map_index = None
+
+    if map_index is not None:
+        # dropped WDTs are read next and take precedence
+        map_definitions.update(map_index.map_definitions())
+        log(f"Loaded {len(map_index.maps)} map definitions from {map_index.path}")
+        for map_name in map_names:
+            indexed_name = map_index.find_map(map_name)
+            if indexed_name is None:
+                print(f"Map '{map_name}' is not in the map index {map_index.path}.")
+                return
+            adt_paths = map_index.adt_paths(indexed_name)
+            log(f"Map '{indexed_name}' has {len(adt_paths)} ADTs.")
+            files_list.extend(adt_paths)
 
     for filepath  in files_list:
         if not filepath.lower().endswith(".wdt"):
@@ -408,32 +578,166 @@ def main():
         if os.path.isfile(filepath ):
             read_wdt_file(filepath)
 
+    got_wdt = bool(map_definitions)
     if not got_wdt:
-        print("Include a WDT to specify the map's alpha format." \
+        log("Include a WDT to specify the map's alpha format." \
         "\nIf no WDT was dropped, small alpha will be used by default, you can add the argument -bigalpha to default to big alpha instead without using a WDT.")
 
-    adt_count = 0
+    adt_files = []
     for filepath  in files_list:
         if not filepath.lower().endswith(".adt"):
-            print(f"Skipping non .adt file: {filepath}")
+            log(f"Skipping non .adt file: {filepath}")
             continue
 
         if os.path.isfile(filepath ):
-            read_adt_file(filepath )
-            adt_count += 1
+            adt_files.append(filepath)
         else:
             print(f"Not a valid file: {filepath }")
 
+    # ADTs of maps read from the archives are not checked on disk, and replace dropped ones
+    adt_files = [filepath for filepath in adt_files if os.path.basename(filepath).split('_')[0] not in mpq_maps] + mpq_adt_files
+    if tile_rect is not None:
+        tiles_count = len(adt_files)
+        adt_files = [filepath for filepath in adt_files if in_tile_rect(filepath)]
+        log(f"Command [-tiles] given, {tiles_count - len(adt_files)} ADTs outside of {tile_rect} are skipped.")
+
+    # files saved from now on, including during the first export, are exported again
+    watcher = FolderWatcher(watch_paths) if watch_mode else None
+
+    # skip ADTs exported by a previous run that did not change since
+    manifests = {} # key = str map_name, value = Manifest
+    adt_maps = {} # key = str filepath, value = str map_name
+    adt_bounds = {} # key = str map_name, value = [min x, min y, max x, max y]
+    for filepath in adt_files:
+        try:
+            map_name, x, y = parse_adt_name(filepath)
+        except (ValueError, IndexError):
+            continue # not named like an ADT, will be reported as failed
+        adt_maps[filepath] = map_name
+        bounds = adt_bounds.setdefault(map_name, [x, y, x, y])
+        bounds[:] = [min(bounds[0], x), min(bounds[1], y), max(bounds[2], x), max(bounds[3], y)]
+
+    # whole map mosaics cover the ADTs given for each map, and the ones of previous exports
+    mosaics_args = {} # key = str map_name, value = MapMosaic arguments
+    reset_maps = set() # maps whose mosaic was reset, every ADT must be written again
+    grown_maps = set() # maps whose mosaic was enlarged, its tiles must be written again
+    if mosaic_tile_size is not None:
+        for map_name, bounds in adt_bounds.items():
+            mosaic = MapMosaic(map_name, os.path.join(map_export_root(map_name), "mosaic"), tuple(bounds), mosaic_tile_size)
+            if not mosaic.prepare():
+                print(f"Map '{map_name}' mosaic canvases had no recorded bounds, all its ADTs will be exported again.")
+                reset_maps.add(map_name)
+            elif mosaic.grown:
+                grown_maps.add(map_name)
+            map_mosaics[map_name] = mosaic
+            mosaics_args[map_name] = (map_name, mosaic.output_root, mosaic.bounds, mosaic_tile_size)
+
+    for map_name in adt_bounds:
+        manifests[map_name] = Manifest(map_output_root(map_name), mpq_chain if map_name in mpq_maps else None)
+
+    skipped_count = 0
+    if not force_export:
+        changed_adt_files = []
+        for filepath in adt_files:
+            map_name = adt_maps.get(filepath)
+            if map_name is not None and map_name not in reset_maps \
+                    and manifests[map_name].is_up_to_date(filepath, map_big_alpha(map_name), output_settings()):
+                skipped_count += 1
+            else:
+                changed_adt_files.append(filepath)
+        adt_files = changed_adt_files
+
+    def record_result(result):
+        adt_timings[result["filepath"]] = result["elapsed"]
+        map_name = adt_maps.get(result["filepath"])
+        if result["metrics"] is not None:
+            total_metrics.merge(result["metrics"])
+            if map_name is not None:
+                maps_metrics.setdefault(map_name, Metrics()).merge(result["metrics"])
+        if result["failed"] or map_name is None:
+            return
+        changed_maps.add(map_name)
+        removed_outputs = manifests[map_name].update(result["filepath"], result["stat"], result["sha1"], map_big_alpha(map_name),
+                                                     output_settings(), result["outputs"], prune=not export_filters)
+        for output_path in removed_outputs:
+            log(f"Removed stale output: {output_path}")
+        stale_outputs.extend(removed_outputs)
+
+    global failed_adts_names
+    alphamap_writer = AlphamapWriter(**writer_settings)
+    changed_maps = reset_maps | grown_maps
+    total_metrics = Metrics()
+    maps_metrics = {} # key = str map_name, value = Metrics
+    adt_timings = {} # key = str filepath, value = float seconds
+    stale_outputs = [] # outputs of a previous export deleted by the manifests
+
+    try:
+        if jobs > 1 and len(adt_files) > 1:
+            print(f"Processing {len(adt_files)} ADTs with {jobs} processes.")
+            with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                     initargs=(map_definitions, default_big_alpha, writer_settings, export_filters, mosaics_args,
+                                               quiet, collect_metrics, mpq_chain, mpq_maps)) as executor:
+                futures = [executor.submit(process_adt_file, filepath) for filepath in adt_files]
+                for future in as_completed(futures):
+                    result = future.result()
+                    record_result(result)
+                    if result["failed"]:
+                        failed_adts_names.append(os.path.splitext(os.path.basename(result["filepath"]))[0])
+        elif prefetch_depth > 0 and len(adt_files) > 1:
+            # reading, decoding and writing overlap on three threads
+            for result in pipeline_adt_files(adt_files, prefetch_depth, encode_depth):
+                record_result(result)
+        else:
+            for filepath in adt_files:
+                record_result(process_adt_file(filepath))
+
+        if map_mosaics:
+            # tiles use the output format, except npz which is per ADT
+            tile_format = alphamap_writer.output_format if alphamap_writer.output_format != "npz" else "png"
+            tile_writer = AlphamapWriter(tile_format, compress_level=alphamap_writer.compress_level, png_filter=alphamap_writer.png_filter)
+            for map_name, mosaic in map_mosaics.items():
+                if map_name not in changed_maps:
+                    continue
+                print(f"Writing map '{map_name}' mosaic tiles...")
+                tiles_start_time = time.perf_counter()
+                tile_count = mosaic.write_tiles(tile_writer.save, "." + tile_format)
+                tiles_metrics = maps_metrics.setdefault(map_name, Metrics())
+                for metrics in (total_metrics, tiles_metrics):
+                    metrics.add("mosaic_tiles", time.perf_counter() - tiles_start_time)
+                    metrics.count("outputs", tile_count)
+                print(f"Wrote {tile_count} tiles in {mosaic.tiles_root}")
+    finally:
+        alphamap_writer.close()
+        for manifest in manifests.values():
+            manifest.save()
+
+    adt_count = len(adt_timings)
+
     end_time = time.time()
     elapsed = end_time - start_time
 
     print(f"Processed {adt_count} ADTs in {elapsed:.2f} seconds.")
-    global failed_adts_names
+    if skipped_count > 0:
+        print(f"Skipped {skipped_count} unchanged ADTs, use -force to export them again.")
+    if stale_outputs:
+        print(f"Removed {len(stale_outputs)} stale outputs of previous exports.")
+    if adt_count > 0:
+        slowest = max(adt_timings, key=adt_timings.get)
+        cpu_time = sum(adt_timings.values())
+        print(f"Time per ADT : {cpu_time / adt_count:.3f}s average, slowest {os.path.basename(slowest)} in {adt_timings[slowest]:.3f}s.")
     failed_adts_count = len(failed_adts_names)
     if failed_adts_count > 0:
         print(f"Failed to process {failed_adts_count} ADTs:")
         print(failed_adts_names)
 
+    if metrics_path is not None:
+        write_metrics(metrics_path, total_metrics, maps_metrics, elapsed)
+        print(f"Metrics written to {metrics_path}")
+
+    if watcher is not None:
+        watch(watcher, jobs, watch_port)
+        return
+
     input("Press Enter to exit...")
     
 
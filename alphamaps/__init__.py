@@ -0,0 +1,60 @@
+"""Export WoW ADT alphamaps per texture instead of per layer.
+
+    from alphamaps import AdtFile, WdtFile
+
+    big_alpha = WdtFile.from_file("Azeroth.wdt").big_alpha
+    adt = AdtFile.from_file("Azeroth_33_55.adt", big_alpha)
+    for texture_name, alphamap in adt.iter_alphamaps():
+        ...  # 1024x1024 uint8 numpy array
+"""
+from .adt import (
+    ALPHAMAP_SIZE,
+    AdtFile,
+    AlphamapError,
+    WdtFile,
+    decode_small_alpha_maps,
+    decompress_alpha_map,
+    parse_adt_name,
+    parse_c_strings,
+    texture_matches,
+)
+from .index import MapIndex
+from .manifest import Manifest
+from .metrics import Metrics
+from .mosaic import MapMosaic
+from .mpq import MpqArchive, MpqChain, MpqError
+from .output import (
+    AlphamapWriter,
+    alphamap_filename,
+    encode_png,
+    save_png,
+    save_r8,
+    save_tga,
+    write_png_files,
+)
+
+__all__ = [
+    "ALPHAMAP_SIZE",
+    "AdtFile",
+    "AlphamapError",
+    "AlphamapWriter",
+    "Manifest",
+    "MapIndex",
+    "MapMosaic",
+    "Metrics",
+    "MpqArchive",
+    "MpqChain",
+    "MpqError",
+    "WdtFile",
+    "alphamap_filename",
+    "decode_small_alpha_maps",
+    "decompress_alpha_map",
+    "encode_png",
+    "parse_adt_name",
+    "parse_c_strings",
+    "save_png",
+    "save_r8",
+    "save_tga",
+    "texture_matches",
+    "write_png_files",
+]
@@ -0,0 +1,514 @@
+"""WDT and ADT (version 18) readers producing one alphamap per texture."""
+import fnmatch
+import os
+import struct
+import time
+import numpy as np
+
+ALPHAMAP_SIZE = 1024 # 64 * 16, size of a whole ADT alphamap
+
+# MCIN entries, 16x16 of them
+mcin_entry_dtype = np.dtype([
+    ('offset', '<u4'),
+    ('size', '<u4'),
+    ('flags', '<u4'),
+    ('async_id', '<u4'),
+])
+
+# start of a MCNK chunk : chunk header followed by the fields of the MCNK header we need
+mcnk_header_dtype = np.dtype([
+    ('magic', 'S4'),
+    ('size', '<u4'),
+    ('flags', '<u4'),
+    ('indexX', '<u4'),
+    ('indexY', '<u4'),
+    ('nLayers', '<u4'),
+    ('nDoodadRefs', '<u4'),
+    ('ofsHeight', '<u4'),
+    ('ofsNormal', '<u4'),
+    ('ofsLayer', '<u4'),
+    ('ofsRefs', '<u4'),
+    ('ofsAlpha', '<u4'),
+    ('sizeAlpha', '<u4'),
+])
+
+
+class AlphamapError(Exception):
+    """Raised when a WDT or ADT file can't be read."""
+
+
+def parse_c_strings(data: bytes, encoding='utf-8') -> list[str]:
+    """Parse null-terminated strings from raw byte data."""
+    raw_strings = data.split(b'\x00')
+    strings = [s.decode(encoding) for s in raw_strings if s]
+    return strings
+
+def normalize_alpha(v):
+    return (v & 0xF) | ((v & 0xF) << 4)
+
+def parse_adt_name(filepath):
+    """Return (map_name, x, y) from an ADT path like 'Azeroth_33_55.adt'."""
+    filename = os.path.splitext(os.path.basename(filepath))[0] # Azeroth_33_55
+    parts = filename.split('_')  # ['Azeroth', '33', '55']
+    return str(parts[0]), int(parts[1]), int(parts[2])
+
+def texture_matches(texture_name, patterns):
+    """True if a texture path or its file name matches one of the glob patterns, without case."""
+    texture_path = texture_name.replace("\\", "/").lower()
+    filename = texture_path.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatchcase(texture_path, pattern.replace("\\", "/").lower())
+               or fnmatch.fnmatchcase(filename, pattern.lower()) for pattern in patterns)
+
+def check_magic(data, pos, expected, chunk_name):
+    magic = bytes(data[pos : pos + 4])
+    if magic != expected:
+        raise AlphamapError("Got {} magic as '{}', expected '{}'.".format(chunk_name, magic, expected.decode()))
+
+def check_version(data, file_type):
+    check_magic(data, 0, b'REVM', "MVER")
+    version = struct.unpack_from('I', data, 8)[0]
+    req_version = 18
+    if (version != req_version):
+        raise AlphamapError("Got {} version '{}', expected '{}'.".format(file_type, version, req_version))
+
+
+# 128 bytes runs for each alpha value, sliced to the fill count when decompressing
+alpha_fill_runs = [bytes([value]) * 128 for value in range(256)]
+
+def decompress_alpha_map(data, offset=0, out=None):
+    """Decode a compressed big alpha MCAL stream starting at data[offset] into a 4096 uint8 array.
+
+    The array is allocated, or given as out (contiguous, 4096 bytes).
+    """
+    alphamap_data = np.empty(4096, dtype=np.uint8) if out is None else out
+    out = memoryview(alphamap_data).cast('B')
+    data_size = len(data)
+    pos = 0
+    i = offset
+    while pos < 4096:
+        if i >= data_size:
+            raise EOFError("Unexpected end of file while decoding alpha map")
+
+        cmd = data[i]
+        i += 1
+        fill_mode = (cmd & 0x80) != 0  # in the first bit of that byte (sign bit) check if it's true. When true that means we are in "fill" mode, if false, "copy" mode
+        count = cmd & 0x7F  # the next 7 bits of the byte determine how many times we "fill" or "copy" (count) (eg, max value 127 - actually 64, see notes)
+
+        # apparently blizz alphamaps can be bugged and have more than 4096, just ignore extra bytes
+        end = min(pos + count, 4096)
+
+        if fill_mode:
+            if i >= data_size:
+                raise EOFError("Unexpected end of file while decoding alpha map")
+            out[pos:end] = alpha_fill_runs[data[i]][:end - pos]
+            i += 1
+        else: # copy mode
+            if i + (end - pos) > data_size:
+                raise EOFError("Unexpected end of file while decoding alpha map")
+            out[pos:end] = data[i:i + end - pos]
+            i += count
+        pos = end
+
+    return alphamap_data
+
+
+# 4 bit alpha expanded to 8 bit, two values per byte (low nibble first), 0xF becomes 0xFF.
+# stored as little endian uint16 so a single take() expands each byte to its two pixels
+small_alpha_lut = np.empty((256, 2), dtype=np.uint8)
+small_alpha_lut[:, 0] = (np.arange(256) & 0x0F) * 0x11
+small_alpha_lut[:, 1] = (np.arange(256) >> 4) * 0x11
+small_alpha_lut = small_alpha_lut.view('<u2').ravel()
+
+def decode_small_alpha_maps(raw_alphamaps, fix_alpha_maps=None):
+    """Expand (N, 2048) packed 4 bit alphamaps to (N, 64, 64) uint8.
+
+    fix_alpha_maps is an optional (N,) bool mask of the alphamaps whose last
+    row and column are not stored by the client and must duplicate row and
+    column 62 (MCNKs without the do_not_fix_alpha_map flag).
+    """
+    raw_alphamaps = np.asarray(raw_alphamaps, dtype=np.uint8)
+    alphamaps = np.take(small_alpha_lut, raw_alphamaps).view(np.uint8).reshape(-1, 64, 64)
+
+    if fix_alpha_maps is not None and fix_alpha_maps.any():
+        fixed = alphamaps[fix_alpha_maps]
+        fixed[:, :, 63] = fixed[:, :, 62]
+        fixed[:, 63, :] = fixed[:, 62, :] # also sets [63, 63] to [62, 62]
+        alphamaps[fix_alpha_maps] = fixed
+
+    return alphamaps
+
+
+class WdtFile:
+    """Map definition read from a WDT file.
+
+    adt_coords lists the (x, y) of the ADTs flagged as existing in the MAIN
+    chunk, empty for maps without terrain.
+    """
+
+    def __init__(self, data, map_name=""):
+        self.map_name = map_name
+        check_version(data, "WDT")
+
+        self.flags = None
+        self.adt_coords = []
+
+        # read chunks until we got MPHD and MAIN chunks
+        pos = 12
+        while pos + 8 <= len(data):
+            magic, size = struct.unpack_from('4sI', data, pos)
+            pos += 8
+
+            if magic == b'DHPM':
+                if size != 32:
+                    raise AlphamapError("Got unexpected WDT MPHD size")
+                self.flags = struct.unpack_from('I', data, pos)[0]
+            elif magic == b'NIAM':
+                if size != 64 * 64 * 8:
+                    raise AlphamapError("Got unexpected WDT MAIN size")
+                # 64x64 entries of flags and async id, row by row, flag 1 means the ADT exists
+                main_flags = np.frombuffer(data, dtype='<u4', count=64 * 64 * 2, offset=pos)[0::2].reshape(64, 64)
+                ys, xs = np.nonzero(main_flags & 1)
+                self.adt_coords = [(int(x), int(y)) for y, x in zip(ys, xs)]
+                break
+            pos += size
+
+        if self.flags is None:
+            raise AlphamapError("WDT has no MPHD chunk.")
+        self.big_alpha = bool(self.flags & 0x04)
+
+    @classmethod
+    def from_file(cls, filepath):
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        map_name = os.path.splitext(os.path.basename(filepath))[0]
+        return cls(data, map_name)
+
+
+class AdtFile:
+    """Texture alphamaps of an ADT file.
+
+    Everything is parsed from the in-memory file data, chunks are decoded on
+    first use by iter_alphamaps. Decoded layers of all MCNKs are kept as one
+    (256, layers, 64, 64) stack with a (256, layers) texture id table, full
+    1024x1024 images are only assembled per texture when requested.
+
+    select() limits the work to some textures and MCNKs, layers of other
+    textures are skipped before their alphamap is read.
+
+    If a Metrics is given, the header, mcnk, decode_<alpha format> and layer0
+    stages are recorded in it. Decode stages count one call and 4096 decoded
+    bytes per alphamap, skipped layers are counted as layers_skipped.
+    """
+
+    def __init__(self, data, map_name="", x=0, y=0, big_alpha=False, metrics=None):
+        self.data = data
+        self.map_name = map_name
+        self.x = x
+        self.y = y
+        self.big_alpha = big_alpha
+        self.metrics = metrics
+        self.layer_tex_ids = None # see decode_alphamaps()
+        self.layer_alphas = None
+        self.selected_textures = None # set of texture ids, see select()
+        self.selected_chunks = None # (256,) bool mask of the MCNKs
+        self.read_header()
+
+    @classmethod
+    def from_file(cls, filepath, big_alpha=False, metrics=None):
+        map_name, x, y = parse_adt_name(filepath)
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        return cls(data, map_name, x, y, big_alpha, metrics)
+
+    def select(self, texture_patterns=None, chunk_rect=None):
+        """Only decode and yield the textures matching glob patterns, in a rect of MCNKs.
+
+        texture_patterns are matched without case against the texture path and
+        its file name, e.g. ['*grass*']. chunk_rect is (min x, min y, max x, max y)
+        in MCNK indices from 0 to 15, alphamaps are black outside of it.
+        None keeps every texture or MCNK.
+        """
+        self.selected_textures = None
+        if texture_patterns is not None:
+            self.selected_textures = {tex_id for tex_id, texture_name in enumerate(self.textures)
+                                      if texture_matches(texture_name, texture_patterns)}
+        self.selected_chunks = None
+        if chunk_rect is not None:
+            min_x, min_y, max_x, max_y = chunk_rect
+            chunk_ids = np.arange(256)
+            chunk_xs = chunk_ids % 16
+            chunk_ys = chunk_ids // 16
+            self.selected_chunks = (chunk_xs >= min_x) & (chunk_xs <= max_x) & (chunk_ys >= min_y) & (chunk_ys <= max_y)
+        # decoded again with the selection on next use
+        self.layer_tex_ids = None
+        self.layer_alphas = None
+
+    def read_header(self):
+        """Read MHDR, the texture names and the MCIN table, then gather all MCNK headers."""
+        start_time = time.perf_counter()
+        data = self.data
+        check_version(data, "ADT")
+
+        # MHDR
+        check_magic(data, 12, b'RDHM', "MHDR")
+        MHDR_data_offset = 20 # where MHDR data starts (mhdr_flags)
+
+        # offset are relative to MHDR_data_offset
+        mhdr_flags, MCIN_offset, MTEX_offset = struct.unpack_from('3I', data, MHDR_data_offset)
+
+        # read textures array
+        MTEX_pos = MHDR_data_offset + MTEX_offset
+        check_magic(data, MTEX_pos, b'XETM', "MTEX")
+        MTEX_size = struct.unpack_from('I', data, MTEX_pos + 4)[0]
+        self.textures = parse_c_strings(bytes(data[MTEX_pos + 8 : MTEX_pos + 8 + MTEX_size]))
+
+        # read MCIN
+        MCIN_pos = MHDR_data_offset + MCIN_offset
+        check_magic(data, MCIN_pos, b'NICM', "MCIN")
+
+        # offset+size, 256 entries in y, x order
+        mcin_entries = np.frombuffer(data, dtype=mcin_entry_dtype, count=256, offset=MCIN_pos + 8)
+        self.mcnk_offsets = mcin_entries['offset'].astype(np.int64)
+
+        if self.mcnk_offsets.max() + mcnk_header_dtype.itemsize > len(data):
+            raise AlphamapError("MCNK offset out of file")
+
+        # gather all MCNK headers in one go
+        data_array = np.frombuffer(data, dtype=np.uint8)
+        mcnk_headers = data_array[self.mcnk_offsets[:, None] + np.arange(mcnk_header_dtype.itemsize)].view(mcnk_header_dtype).ravel()
+
+        bad_magic = np.flatnonzero(mcnk_headers['magic'] != b'KNCM')
+        if len(bad_magic) > 0:
+            raise AlphamapError("Got MCNK magic as '{}', expected 'KNCM'.".format(mcnk_headers['magic'][bad_magic[0]]))
+
+        if not (mcnk_headers['size'] == mcin_entries['size'] - 8).all():
+            raise AlphamapError("MCNK size does not match its MCIN entry.")
+
+        chunk_ids = np.arange(256)
+        if not (mcnk_headers['indexX'] == chunk_ids % 16).all():
+            raise AlphamapError("MCNK X index did not match its MCIN position.")
+        if not (mcnk_headers['indexY'] == chunk_ids // 16).all():
+            raise AlphamapError("MCNK Y index did not match its MCIN position.")
+
+        self.mcnk_headers = mcnk_headers
+
+        if self.metrics is not None:
+            self.metrics.add("header", time.perf_counter() - start_time, len(data))
+
+    def read_layers(self):
+        """Walk the MCNKs and return, per MCNK, (flags, alpha data position, alpha size, MCLY entries).
+
+        MCNKs outside of the selected ones get no MCLY entries.
+        """
+        start_time = time.perf_counter()
+        data = self.data
+        data_view = memoryview(data)
+        mcnk_headers = self.mcnk_headers
+        selected_chunks = self.selected_chunks.tolist() if self.selected_chunks is not None else [True] * 256
+        chunks = []
+
+        for selected, MCNK_CHUNK_offset, MCNK_Flags, num_layers, offset_MCLY, offset_MCAL, size_Alpha in zip(
+            selected_chunks,
+            self.mcnk_offsets.tolist(),
+            mcnk_headers['flags'].tolist(),
+            mcnk_headers['nLayers'].tolist(),
+            mcnk_headers['ofsLayer'].tolist(),
+            mcnk_headers['ofsAlpha'].tolist(), #offset to magic, not data
+            mcnk_headers['sizeAlpha'].tolist(), # includes chunk header(magic+size). sum of data of all layers
+        ):
+            if not selected:
+                chunks.append((MCNK_Flags, 0, 0, []))
+                continue
+
+            # MCLY
+            MCLY_pos = MCNK_CHUNK_offset + offset_MCLY
+            check_magic(data, MCLY_pos, b'YLCM', "MCLY")
+            MCLY_size = struct.unpack_from('I', data, MCLY_pos + 4)[0]
+            if num_layers != MCLY_size / 16:
+                raise AlphamapError(f"Unexpected MCLY size {MCLY_size} for {num_layers} layers.")
+
+            # Skip magic + size
+            layers = list(struct.iter_unpack('4I', data_view[MCLY_pos + 8 : MCLY_pos + 8 + num_layers * 16]))
+
+            alpha_data_pos = MCNK_CHUNK_offset + offset_MCAL + 8 # Skip magic + size
+            chunks.append((MCNK_Flags, alpha_data_pos, size_Alpha, layers))
+
+        if self.metrics is not None:
+            self.metrics.add("mcnk", time.perf_counter() - start_time)
+        return chunks
+
+    def decode_alphamaps(self):
+        """Decode the alphamap of every layer and derive layer 0 from them, for all MCNKs at once.
+
+        Fills layer_tex_ids, (256, layers) texture ids with -1 for missing
+        layers, and layer_alphas, (256, layers, 64, 64) alphamaps.
+        """
+        self.composite_layers(*self.decode_layers(self.read_layers()))
+
+    def decode_layers(self, chunks):
+        """Decode the alphamaps of the MCNKs returned by read_layers().
+
+        Returns (layer_tex_ids, layer_alphas), layer 0 alphamaps are left to composite_layers().
+        """
+        data_view = memoryview(self.data)
+        big_alpha = self.big_alpha
+        alphamap_size = 4096 if big_alpha else 2048
+        num_textures = len(self.textures)
+        metrics = self.metrics
+        decode_times = {"small": 0.0, "big": 0.0, "compressed": 0.0} # key = alpha format, only filled with metrics
+        decode_counts = dict.fromkeys(decode_times, 0)
+        selected_textures = self.selected_textures
+        skipped_count = 0
+
+        max_layers = max(max(len(layers) for _, _, _, layers in chunks), 1)
+        layer_tex_ids = np.full((256, max_layers), -1, dtype=np.int32)
+        layer_alphas = np.zeros((256, max_layers, 64, 64), dtype=np.uint8)
+
+        # 4 bit alphamaps are gathered and decoded together after the walk
+        small_alpha_positions = []
+        small_alpha_slots = [] # (chunk index, layer id)
+        small_alpha_fixes = []
+
+        for chunk_index, (MCNK_Flags, alpha_data_pos, size_Alpha, layers) in enumerate(chunks):
+            do_not_fix_alpha_map = bool(MCNK_Flags & (1 << 15))
+            # layer 0 is what the other layers leave, if its texture is selected every layer is needed
+            decode_all = selected_textures is None or (layers and layers[0][0] in selected_textures)
+
+            for layer_id, (tex_id, flags, ofsalphamap, effect_id) in enumerate(layers):
+                if not decode_all and tex_id not in selected_textures:
+                    skipped_count += 1
+                    continue
+
+                use_alpha_map = bool(flags & 0x100)
+                alpha_map_compressed  = bool(flags & 0x200)
+
+                if tex_id >= num_textures:
+                    raise AlphamapError(f"MCLY texture id {tex_id} exceeds the {num_textures} MTEX textures.")
+                layer_tex_ids[chunk_index, layer_id] = tex_id
+
+                if layer_id == 0:
+                    if use_alpha_map:
+                        raise AlphamapError("Layer 0 should never have an alpha map.")
+                    continue
+
+                if not use_alpha_map:
+                    raise AlphamapError(f"Layer {layer_id} doesn't use an alpha map.")
+
+                # read alphamap (MCAL)
+                if not alpha_map_compressed:
+                    if ofsalphamap + alphamap_size > size_Alpha:
+                        raise AlphamapError(f"Alphamap at offset {ofsalphamap} exceeds the {size_Alpha} bytes MCAL.")
+
+                alpha_pos = alpha_data_pos + ofsalphamap
+                if not big_alpha:
+                    if alpha_map_compressed:
+                        raise AlphamapError("Alpha map is compressed but the map does not use big alpha, only big alpha can be compressed.")
+                    small_alpha_positions.append(alpha_pos)
+                    small_alpha_slots.append((chunk_index, layer_id))
+                    small_alpha_fixes.append(not do_not_fix_alpha_map)
+                    continue
+
+                if metrics is not None:
+                    layer_start_time = time.perf_counter()
+
+                # decoded straight into the layer's slot of the stack
+                alphamap_data = layer_alphas[chunk_index, layer_id].reshape(4096)
+                if not alpha_map_compressed:
+                    alphamap_data[:] = np.frombuffer(data_view[alpha_pos : alpha_pos + 4096], dtype=np.uint8)
+                else: # compressed
+                    # compressed size is unknown, decode from what is left of this MCNK's MCAL
+                    decompress_alpha_map(data_view[alpha_pos : alpha_data_pos + size_Alpha], out=alphamap_data)
+
+                if metrics is not None:
+                    alpha_format = "compressed" if alpha_map_compressed else "big"
+                    decode_times[alpha_format] += time.perf_counter() - layer_start_time
+                    decode_counts[alpha_format] += 1
+
+        if small_alpha_positions:
+            start_time = time.perf_counter()
+            positions = np.array(small_alpha_positions, dtype=np.int64)
+            if positions.max() + 2048 > len(self.data):
+                raise AlphamapError("MCAL alphamap out of file")
+            data_array = np.frombuffer(self.data, dtype=np.uint8)
+            raw_alphamaps = data_array[positions[:, None] + np.arange(2048)]
+
+            chunk_indices, layer_ids = np.array(small_alpha_slots).T
+            layer_alphas[chunk_indices, layer_ids] = decode_small_alpha_maps(raw_alphamaps, np.array(small_alpha_fixes))
+            decode_times["small"] += time.perf_counter() - start_time
+            decode_counts["small"] += len(small_alpha_positions)
+
+        if metrics is not None:
+            for alpha_format, decode_count in decode_counts.items():
+                if decode_count > 0:
+                    metrics.add(f"decode_{alpha_format}", decode_times[alpha_format], decode_count * 4096, decode_count)
+            if skipped_count > 0:
+                metrics.count("layers_skipped", skipped_count)
+        return layer_tex_ids, layer_alphas
+
+    def composite_layers(self, layer_tex_ids, layer_alphas):
+        """Derive layer 0 of every MCNK from the other layers and keep the stack for alphamap()."""
+        start_time = time.perf_counter()
+
+        # layer 0 gets what the other layers leave, saturating at 0 when they add up to more than 255.
+        # one saturating uint8 subtraction per layer slot, for all MCNKs at once
+        layer0_alphas = layer_alphas[:, 0]
+        layer0_alphas.fill(255)
+        subtracted = np.empty_like(layer0_alphas)
+        for layer_id in range(1, layer_alphas.shape[1]):
+            np.minimum(layer0_alphas, layer_alphas[:, layer_id], out=subtracted)
+            layer0_alphas -= subtracted
+
+        self.layer_tex_ids = layer_tex_ids
+        self.layer_alphas = layer_alphas
+
+        if self.metrics is not None:
+            self.metrics.add("layer0", time.perf_counter() - start_time)
+
+    def referenced_textures(self):
+        """Return the ids of the textures used by at least one MCNK, in MTEX order."""
+        if self.layer_alphas is None:
+            self.decode_alphamaps()
+        return np.unique(self.layer_tex_ids[self.layer_tex_ids >= 0]).tolist()
+
+    def texture_cells(self, tex_id):
+        """Return the (256, 64, 64) alphamaps of a texture per MCNK, black where the texture is not used."""
+        if self.layer_alphas is None:
+            self.decode_alphamaps()
+
+        num_layers = self.layer_tex_ids.shape[1]
+        # when a texture is on several layers of a MCNK, layer 0 wins, then the last layer
+        layer_priority = np.arange(num_layers)
+        layer_priority[0] = num_layers
+        priority = np.where(self.layer_tex_ids == tex_id, layer_priority, -1)
+        chosen_layers = priority.argmax(axis=1)
+
+        cells = self.layer_alphas[np.arange(256), chosen_layers]
+        cells[priority.max(axis=1) < 0] = 0
+        return cells
+
+    def alphamap(self, tex_id):
+        """Assemble the 1024x1024 uint8 alphamap of a texture."""
+        cells = self.texture_cells(tex_id)
+        # (mcnk y, mcnk x, row, column) to (mcnk y, row, mcnk x, column)
+        return cells.reshape(16, 16, 64, 64).transpose(0, 2, 1, 3).reshape(ALPHAMAP_SIZE, ALPHAMAP_SIZE)
+
+    def iter_alphamap_rows(self, tex_id):
+        """Yield the alphamap of a texture as 16 row blocks of 64x1024, one per MCNK row."""
+        cells = self.texture_cells(tex_id).reshape(16, 16, 64, 64)
+        for mcnk_y in range(16):
+            yield cells[mcnk_y].transpose(1, 0, 2).reshape(64, ALPHAMAP_SIZE)
+
+    def iter_alphamaps(self, skip_unreferenced=False):
+        """Yield (texture_name, 1024x1024 uint8 array) for each texture of the ADT, one at a time.
+
+        With skip_unreferenced, textures no MCNK uses (fully black alphamaps) are not yielded.
+        Textures left out by select() are never yielded.
+        """
+        referenced_textures = set(self.referenced_textures())
+
+        for tex_id, texture_name in enumerate(self.textures):
+            if skip_unreferenced and tex_id not in referenced_textures:
+                continue
+            if self.selected_textures is not None and tex_id not in self.selected_textures:
+                continue
+            yield texture_name, self.alphamap(tex_id)
@@ -0,0 +1,103 @@
+"""Index of the maps of a client extract, built once so later exports never walk it again."""
+import json
+import os
+
+from .adt import WdtFile
+
+INDEX_VERSION = 1
+
+
+class MapIndex:
+    """Map definitions and existing ADTs of a whole client extract, stored as json.
+
+    Each map entry keeps the WDT path and flags, its big alpha mode, and the
+    (x, y, path) of the ADTs flagged in the WDT MAIN chunk and found on disk.
+    Paths are relative to the indexed root folder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = ""
+        self.maps = {} # key = str map_name, value = dict entry
+
+    @classmethod
+    def load(cls, path):
+        index = cls(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            content = json.load(f)
+        if content.get("version") != INDEX_VERSION:
+            raise ValueError(f"{path} is not a version {INDEX_VERSION} map index, build it again.")
+        index.root = content["root"]
+        index.maps = content["maps"]
+        return index
+
+    def build(self, root, on_error=None):
+        """Scan every WDT under root and the ADTs next to them, return the number of maps indexed.
+
+        on_error(filepath, exception) is called for WDTs that can't be read, they are left out of the index.
+        """
+        self.root = os.path.abspath(root)
+        self.maps = {}
+
+        # one walk for the whole extract, file names are matched without case like the client does
+        folders = {} # key = str folder relative to root, value = dict lower file name -> file name
+        for folder, dirs, files in os.walk(self.root):
+            dirs.sort()
+            relative_folder = os.path.relpath(folder, self.root)
+            folders[relative_folder] = {filename.lower(): filename for filename in sorted(files)}
+
+        for relative_folder, filenames in folders.items():
+            for filename in filenames.values():
+                if not filename.lower().endswith(".wdt"):
+                    continue
+                wdt_path = os.path.normpath(os.path.join(relative_folder, filename))
+                try:
+                    wdt = WdtFile.from_file(os.path.join(self.root, wdt_path))
+                except Exception as e:
+                    if on_error is not None:
+                        on_error(wdt_path, e)
+                    continue
+
+                adts = []
+                missing_count = 0
+                for x, y in wdt.adt_coords:
+                    adt_filename = filenames.get(f"{wdt.map_name}_{x}_{y}.adt".lower())
+                    if adt_filename is None:
+                        missing_count += 1
+                        continue
+                    adts.append([x, y, os.path.normpath(os.path.join(relative_folder, adt_filename))])
+
+                self.maps[wdt.map_name] = {
+                    "wdt": wdt_path,
+                    "flags": wdt.flags,
+                    "big_alpha": wdt.big_alpha,
+                    "adts": adts,
+                    "missing_adts": missing_count, # flagged in MAIN but not extracted
+                }
+        return len(self.maps)
+
+    def save(self):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": INDEX_VERSION, "root": self.root, "maps": self.maps}, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def find_map(self, map_name):
+        """Return the indexed name of map_name, compared without case, or None."""
+        if map_name in self.maps:
+            return map_name
+        for indexed_name in self.maps:
+            if indexed_name.lower() == map_name.lower():
+                return indexed_name
+        return None
+
+    def map_definitions(self):
+        """Big alpha mode per map name."""
+        return {map_name: entry["big_alpha"] for map_name, entry in self.maps.items()}
+
+    def adt_paths(self, map_name):
+        """Paths of the existing ADTs of an indexed map."""
+        return [os.path.join(self.root, path) for x, y, path in self.maps[map_name]["adts"]]
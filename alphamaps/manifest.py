@@ -0,0 +1,118 @@
+"""Record of exported ADTs, used to skip unchanged tiles on the next export."""
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class Manifest:
+    """Exported ADTs of one map, stored as <output_root>/manifest.json.
+
+    Each ADT entry keeps the source file size, mtime and sha1, the big alpha
+    mode and writer settings used, and the output files produced (relative to
+    output_root).
+
+    source is an optional object with stat(filepath) and read_file(filepath)
+    methods (e.g. an MpqChain) for ADTs which are not files on disk.
+    """
+
+    def __init__(self, output_root, source=None):
+        self.output_root = output_root
+        self.source = source
+        self.path = os.path.join(output_root, MANIFEST_NAME)
+        self.adts = {} # key = str ADT file name, value = dict entry
+        self.changed = False
+
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    content = json.load(f)
+                if content.get("version") == MANIFEST_VERSION:
+                    self.adts = content.get("adts", {})
+            except (OSError, ValueError):
+                # unreadable manifest, everything gets exported again
+                self.adts = {}
+
+    def is_up_to_date(self, filepath, big_alpha, settings):
+        """Return True if filepath was already exported with the same source, big alpha mode and settings."""
+        entry = self.adts.get(os.path.basename(filepath))
+        if entry is None:
+            return False
+        if entry["big_alpha"] != big_alpha or entry["settings"] != settings:
+            return False
+        if not all(os.path.isfile(os.path.join(self.output_root, output)) for output in entry["outputs"]):
+            return False
+
+        stat = self.stat(filepath)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+
+        # touched but maybe not modified, compare content
+        if file_sha1(self.read_file(filepath)) != entry["sha1"]:
+            return False
+        entry["mtime_ns"] = stat.st_mtime_ns
+        self.changed = True
+        return True
+
+    def update(self, filepath, source_stat, sha1, big_alpha, settings, output_paths, prune=True):
+        """Record an exported ADT and delete the outputs its previous export produced but this one did not.
+
+        source_stat is the (size, mtime_ns) of the source taken when it was read
+        and hashed, not now, so a file saved again meanwhile is exported again.
+        With prune False (partial exports), previous outputs are kept and listed with the new ones.
+        """
+        name = os.path.basename(filepath)
+        outputs = set(os.path.relpath(output_path, self.output_root) for output_path in output_paths)
+
+        previous_entry = self.adts.get(name)
+        removed_outputs = []
+        if previous_entry is not None and not prune:
+            outputs.update(output for output in previous_entry["outputs"]
+                           if os.path.isfile(os.path.join(self.output_root, output)))
+        elif previous_entry is not None:
+            for output in set(previous_entry["outputs"]) - outputs:
+                output_path = os.path.join(self.output_root, output)
+                if os.path.isfile(output_path):
+                    os.remove(output_path)
+                    removed_outputs.append(output_path)
+
+        size, mtime_ns = source_stat
+        self.adts[name] = {
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "sha1": sha1,
+            "big_alpha": big_alpha,
+            "settings": settings,
+            "outputs": sorted(outputs),
+        }
+        self.changed = True
+        return removed_outputs
+
+    def stat(self, filepath):
+        if self.source is not None:
+            return self.source.stat(filepath)
+        return os.stat(filepath)
+
+    def read_file(self, filepath):
+        if self.source is not None:
+            return self.source.read_file(filepath)
+        with open(filepath, 'rb') as f:
+            return f.read()
+
+    def save(self):
+        if not self.changed:
+            return
+        os.makedirs(self.output_root, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": MANIFEST_VERSION, "adts": self.adts}, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+        self.changed = False
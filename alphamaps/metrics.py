@@ -0,0 +1,90 @@
+"""Opt-in instrumentation : time and bytes per export stage, plus counters."""
+import csv
+import json
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """Time, bytes and calls per stage, and named counters.
+
+    Stages used by the package :
+        read, header, mcnk, decode_small, decode_big, decode_compressed
+        (one call per alphamap), layer0, encode, mosaic, mosaic_tiles.
+    Counters : adts, adts_failed, textures, outputs, layers_skipped (by
+    AdtFile.select()), and "failed: <exception type>" per failure reason.
+    Failures keep the full error message of each failed file.
+    """
+
+    def __init__(self):
+        self.stages = {} # key = str stage name, value = [seconds, bytes, calls]
+        self.counters = {} # key = str counter name, value = int
+        self.failures = [] # dict of adt, reason and message per failed file
+
+    def add(self, stage, seconds, num_bytes=0, calls=1):
+        totals = self.stages.setdefault(stage, [0.0, 0, 0])
+        totals[0] += seconds
+        totals[1] += num_bytes
+        totals[2] += calls
+
+    @contextmanager
+    def stage(self, stage, num_bytes=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, num_bytes)
+
+    def count(self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def fail(self, name, error):
+        """Count a failed file under its exception type, and keep its message."""
+        reason = type(error).__name__
+        self.count("adts_failed")
+        self.count(f"failed: {reason}")
+        self.failures.append({"adt": name, "reason": reason, "message": str(error)})
+
+    def merge(self, other):
+        """Add the stages and counters of another Metrics, or of its as_dict()."""
+        if isinstance(other, Metrics):
+            other = other.as_dict()
+        for stage, totals in other["stages"].items():
+            self.add(stage, totals["seconds"], totals["bytes"], totals["calls"])
+        for counter, value in other["counters"].items():
+            self.count(counter, value)
+        self.failures.extend(other.get("failures", []))
+
+    def as_dict(self):
+        return {
+            "stages": {stage: {"seconds": seconds, "bytes": num_bytes, "calls": calls}
+                       for stage, (seconds, num_bytes, calls) in sorted(self.stages.items())},
+            "counters": dict(sorted(self.counters.items())),
+            "failures": list(self.failures),
+        }
+
+
+def write_metrics(output_path, total, maps=None, elapsed=None):
+    """Write a run summary as json, or csv if output_path ends with .csv.
+
+    total is the Metrics of the whole run, maps an optional dict of Metrics per map name.
+    """
+    maps = maps or {}
+    if output_path.lower().endswith(".csv"):
+        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["scope", "kind", "name", "seconds", "bytes", "count"])
+            if elapsed is not None:
+                writer.writerow(["total", "run", "elapsed", f"{elapsed:.6f}", "", ""])
+            for scope, metrics in [("total", total)] + sorted(maps.items()):
+                for stage, (seconds, num_bytes, calls) in sorted(metrics.stages.items()):
+                    writer.writerow([scope, "stage", stage, f"{seconds:.6f}", num_bytes, calls])
+                for counter, value in sorted(metrics.counters.items()):
+                    writer.writerow([scope, "counter", counter, "", "", value])
+                for failure in metrics.failures:
+                    writer.writerow([scope, "failure", f"{failure['adt']}: {failure['reason']}: {failure['message']}", "", "", 1])
+    else:
+        summary = {"elapsed": elapsed, "total": total.as_dict(),
+                   "maps": {map_name: metrics.as_dict() for map_name, metrics in sorted(maps.items())}}
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=1)
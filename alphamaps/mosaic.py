@@ -0,0 +1,273 @@
+"""Whole map alphamap mosaics, stitched into disk backed canvases while ADTs are exported."""
+import json
+import os
+import shutil
+
+import numpy as np
+
+from .adt import ALPHAMAP_SIZE
+from .output import save_png
+
+CANVAS_EXTENSION = ".canvas"
+RECORD_EXTENSION = ".keys"
+
+
+def texture_key(texture_name):
+    """Canvas name of a texture, textures with the same file name share a mosaic."""
+    return os.path.splitext(os.path.basename(texture_name.replace("\\", "/")))[0].lower()
+
+def bounds_shape(bounds):
+    """Canvas shape of the ADTs between bounds (min_x, min_y, max_x, max_y)."""
+    min_x, min_y, max_x, max_y = bounds
+    return ((max_y - min_y + 1) * ALPHAMAP_SIZE, (max_x - min_x + 1) * ALPHAMAP_SIZE)
+
+def downsample(block):
+    """Halve a uint8 block with a rounded 2x2 average, odd edges are repeated."""
+    height, width = block.shape
+    if height % 2 or width % 2:
+        block = np.pad(block, ((0, height % 2), (0, width % 2)), mode='edge')
+    summed = block.reshape(block.shape[0] // 2, 2, block.shape[1] // 2, 2).sum(axis=(1, 3), dtype=np.uint16)
+    return ((summed + 2) >> 2).astype(np.uint8)
+
+
+class MapMosaic:
+    """Per texture alphamaps of a whole map, one disk backed canvas per texture.
+
+    Canvases cover the ADTs between bounds (min_x, min_y, max_x, max_y), 1024
+    pixels per ADT, and live in <output_root>/canvas as raw uint8 files opened
+    with np.memmap, so a map is never held in memory. ADTs of a map can be
+    added from several processes at once as they write disjoint regions.
+    The texture keys each ADT wrote are recorded next to the canvases, so an
+    ADT added again only clears the textures it no longer uses.
+    write_tiles() then cuts every canvas into tile_size tiles, plus halved mip
+    levels until a level fits in one tile.
+
+    prepare() grows the bounds to cover the ones of the previous export, so
+    exporting a few ADTs again updates their region of the whole map mosaic.
+    """
+
+    def __init__(self, map_name, output_root, bounds, tile_size=4096):
+        if tile_size < 2 or tile_size % 2:
+            raise ValueError(f"Mosaic tile size must be an even number, got {tile_size}.")
+        self.map_name = map_name
+        self.output_root = output_root
+        self.bounds = tuple(bounds)
+        self.tile_size = tile_size
+        self.canvas_root = os.path.join(output_root, "canvas")
+        self.tiles_root = os.path.join(output_root, "tiles")
+        self.info_path = os.path.join(output_root, "mosaic.json")
+
+        self.shape = bounds_shape(self.bounds)
+        self.grown = False # canvases were enlarged by prepare()
+        self.canvases = {} # key = str texture key, value = np.memmap, opened in this process
+        self.info = self.read_info()
+
+    def read_info(self):
+        if not os.path.isfile(self.info_path):
+            return {}
+        with open(self.info_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def prepare(self):
+        """Create the mosaic folder and merge the bounds with the ones of existing canvases, growing them if needed.
+
+        Return False if existing canvases had no recorded bounds and were deleted.
+        """
+        os.makedirs(self.canvas_root, exist_ok=True)
+        up_to_date = True
+        if self.info.get("adt_bounds"):
+            previous_bounds = tuple(self.info["adt_bounds"])
+            bounds = (min(self.bounds[0], previous_bounds[0]), min(self.bounds[1], previous_bounds[1]),
+                      max(self.bounds[2], previous_bounds[2]), max(self.bounds[3], previous_bounds[3]))
+            self.bounds = bounds
+            self.shape = bounds_shape(bounds)
+            if bounds != previous_bounds:
+                self.grow(previous_bounds)
+        elif self.canvas_keys():
+            up_to_date = False
+
+        if not up_to_date:
+            for key in self.canvas_keys():
+                os.remove(self.canvas_path(key))
+            for name in os.listdir(self.canvas_root):
+                if name.endswith(RECORD_EXTENSION):
+                    os.remove(os.path.join(self.canvas_root, name))
+            self.info = {}
+        if not self.info:
+            # canvases of older exports have no texture records, see add_adt
+            self.info["adt_records"] = not self.canvas_keys()
+
+        self.save_info()
+        return up_to_date
+
+    def grow(self, previous_bounds):
+        """Move canvases covering previous_bounds into canvases covering the current bounds."""
+        previous_shape = bounds_shape(previous_bounds)
+        y_offset = (previous_bounds[1] - self.bounds[1]) * ALPHAMAP_SIZE
+        x_offset = (previous_bounds[0] - self.bounds[0]) * ALPHAMAP_SIZE
+        for key in self.canvas_keys():
+            path = self.canvas_path(key)
+            temp_path = path + ".tmp"
+            previous_canvas = np.memmap(path, dtype=np.uint8, mode='r', shape=previous_shape)
+            canvas = np.memmap(temp_path, dtype=np.uint8, mode='w+', shape=self.shape)
+            # ADT by ADT, black ones are left unwritten so the file stays sparse
+            for y in range(0, previous_shape[0], ALPHAMAP_SIZE):
+                for x in range(0, previous_shape[1], ALPHAMAP_SIZE):
+                    block = previous_canvas[y : y + ALPHAMAP_SIZE, x : x + ALPHAMAP_SIZE]
+                    if block.any():
+                        canvas[y_offset + y : y_offset + y + ALPHAMAP_SIZE, x_offset + x : x_offset + x + ALPHAMAP_SIZE] = block
+            canvas.flush()
+            del previous_canvas, canvas
+            os.replace(temp_path, path)
+        self.grown = True
+
+    def save_info(self, levels=None):
+        info = {
+            "map": self.map_name,
+            "adt_bounds": list(self.bounds), # min x, min y, max x, max y of the ADTs covered
+            "shape": list(self.shape),
+            "tile_size": self.tile_size,
+            "textures": self.canvas_keys(),
+            "adt_records": self.info.get("adt_records", False), # every ADT in the canvases has its texture keys recorded
+        }
+        if levels is not None:
+            info["levels"] = levels
+        with open(self.info_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f, indent=1)
+        self.info = info
+
+    def canvas_path(self, key):
+        return os.path.join(self.canvas_root, key + CANVAS_EXTENSION)
+
+    def record_path(self, x, y):
+        return os.path.join(self.canvas_root, f"{x}_{y}{RECORD_EXTENSION}")
+
+    def read_record(self, x, y):
+        """Texture keys written by the last export of ADT x_y, or None if it has no record."""
+        path = self.record_path(x, y)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return set(json.load(f))
+
+    def canvas_keys(self):
+        if not os.path.isdir(self.canvas_root):
+            return []
+        return sorted(os.path.splitext(name)[0] for name in os.listdir(self.canvas_root) if name.endswith(CANVAS_EXTENSION))
+
+    def canvas(self, key):
+        canvas = self.canvases.get(key)
+        if canvas is None:
+            path = self.canvas_path(key)
+            # growing to the same size is harmless if another process created it first
+            with open(path, 'ab') as f:
+                if f.tell() < self.shape[0] * self.shape[1]:
+                    f.truncate(self.shape[0] * self.shape[1])
+            canvas = np.memmap(path, dtype=np.uint8, mode='r+', shape=self.shape)
+            self.canvases[key] = canvas
+        return canvas
+
+    def add_adt(self, adt):
+        """Write the alphamaps of an AdtFile in its region of the canvases."""
+        min_x, min_y, max_x, max_y = self.bounds
+        if not (min_x <= adt.x <= max_x and min_y <= adt.y <= max_y):
+            raise ValueError(f"ADT {adt.x}_{adt.y} is outside of the mosaic bounds {self.bounds}.")
+        y_pos = (adt.y - min_y) * ALPHAMAP_SIZE
+        x_pos = (adt.x - min_x) * ALPHAMAP_SIZE
+
+        written_keys = set()
+        for texture_name, alphamap in adt.iter_alphamaps(skip_unreferenced=True):
+            key = texture_key(texture_name)
+            canvas = self.canvas(key)
+            if key in written_keys: # same texture file twice in MTEX, keep both
+                alphamap = np.maximum(canvas[y_pos : y_pos + ALPHAMAP_SIZE, x_pos : x_pos + ALPHAMAP_SIZE], alphamap)
+            canvas[y_pos : y_pos + ALPHAMAP_SIZE, x_pos : x_pos + ALPHAMAP_SIZE] = alphamap
+            written_keys.add(key)
+
+        # clear textures this ADT used in a previous export but not anymore,
+        # textures left out by AdtFile.select() keep what was exported before
+        previous_keys = self.read_record(adt.x, adt.y)
+        if previous_keys is None:
+            # never added, or added before texture records : only canvases
+            # of older exports can hold its textures, they are all checked
+            previous_keys = set() if self.info.get("adt_records", True) else set(self.canvas_keys())
+        kept_keys = set()
+        if adt.selected_textures is not None:
+            selected_keys = {texture_key(adt.textures[tex_id]) for tex_id in adt.selected_textures}
+            kept_keys = previous_keys - selected_keys
+        cleared_keys = previous_keys - written_keys - kept_keys
+        for key in cleared_keys:
+            if not os.path.isfile(self.canvas_path(key)):
+                continue
+            region = self.canvas(key)[y_pos : y_pos + ALPHAMAP_SIZE, x_pos : x_pos + ALPHAMAP_SIZE]
+            if region.any():
+                region[:] = 0
+
+        self.flush(written_keys | cleared_keys)
+        with open(self.record_path(adt.x, adt.y), 'w', encoding='utf-8') as f:
+            json.dump(sorted(written_keys | kept_keys), f)
+
+    def flush(self, keys=None):
+        """Flush the open canvases, or only the ones of keys."""
+        for key, canvas in self.canvases.items():
+            if keys is None or key in keys:
+                canvas.flush()
+
+    def close(self):
+        self.flush()
+        self.canvases = {}
+
+    def write_tiles(self, save=save_png, extension=".png"):
+        """Write every canvas as tiles and mip levels, return the number of tiles written.
+
+        Tiles are written as tiles/<texture>/L<level>/<tile x>_<tile y><extension>,
+        fully black tiles are skipped.
+        """
+        self.close()
+        tile_size = self.tile_size
+        levels = 0
+        tile_count = 0
+
+        for key in self.canvas_keys():
+            level = 0
+            level_canvas = np.memmap(self.canvas_path(key), dtype=np.uint8, mode='r', shape=self.shape)
+            mip_paths = []
+            # tiles of the previous export may be black now
+            shutil.rmtree(os.path.join(self.tiles_root, key), ignore_errors=True)
+
+            while True:
+                height, width = level_canvas.shape
+                last_level = max(height, width) <= tile_size
+                next_canvas = None
+                if not last_level:
+                    mip_path = os.path.join(self.canvas_root, f"{key}.L{level + 1}.mip")
+                    next_canvas = np.memmap(mip_path, dtype=np.uint8, mode='w+', shape=((height + 1) // 2, (width + 1) // 2))
+                    mip_paths.append(mip_path)
+
+                level_root = os.path.join(self.tiles_root, key, f"L{level}")
+                os.makedirs(level_root, exist_ok=True)
+
+                for tile_y in range(0, height, tile_size):
+                    for tile_x in range(0, width, tile_size):
+                        tile = np.asarray(level_canvas[tile_y : tile_y + tile_size, tile_x : tile_x + tile_size])
+                        if not tile.any(): # mip canvases start black too
+                            continue
+                        save(np.ascontiguousarray(tile), os.path.join(level_root, f"{tile_x // tile_size}_{tile_y // tile_size}{extension}"))
+                        tile_count += 1
+                        if next_canvas is not None:
+                            next_canvas[tile_y // 2 : (tile_y + tile.shape[0] + 1) // 2,
+                                        tile_x // 2 : (tile_x + tile.shape[1] + 1) // 2] = downsample(tile)
+
+                if next_canvas is None:
+                    break
+                next_canvas.flush()
+                level_canvas = next_canvas
+                level += 1
+
+            del level_canvas, next_canvas
+            for mip_path in mip_paths:
+                os.remove(mip_path)
+            levels = max(levels, level + 1)
+
+        self.save_info(levels)
+        return tile_count
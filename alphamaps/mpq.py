@@ -0,0 +1,344 @@
+"""Read-only access to files stored in MPQ archives (format version 0 and 1, as shipped with the 1.x to 3.x clients).
+
+    from alphamaps import MpqChain
+
+    chain = MpqChain.from_folder("World of Warcraft/Data")
+    data = chain.read_file("World\\Maps\\Azeroth\\Azeroth_32_48.adt")
+
+Only the hash and block tables are read when an archive is opened, file
+sectors are read and decompressed when a file is requested. zlib and bzip2
+compressed sectors are supported, PKWARE implode, huffman, ADPCM and LZMA
+(used by sounds and later clients, not by map files) are not.
+"""
+import bz2
+import os
+import struct
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+MPQ_EXTENSION = ".mpq"
+
+# block flags
+MPQ_FILE_IMPLODE = 0x00000100
+MPQ_FILE_COMPRESS = 0x00000200
+MPQ_FILE_ENCRYPTED = 0x00010000
+MPQ_FILE_FIX_KEY = 0x00020000
+MPQ_FILE_PATCH_FILE = 0x00100000
+MPQ_FILE_SINGLE_UNIT = 0x01000000
+MPQ_FILE_DELETE_MARKER = 0x02000000
+MPQ_FILE_SECTOR_CRC = 0x04000000
+MPQ_FILE_EXISTS = 0x80000000
+
+# sector compression masks
+COMPRESSION_ZLIB = 0x02
+COMPRESSION_BZIP2 = 0x10
+
+HASH_ENTRY_DELETED = 0xFFFFFFFE # 0xFFFFFFFF is an empty entry
+
+mpq_header_struct = struct.Struct('<4sIIHHIIII')
+mpq_header_v1_struct = struct.Struct('<QHH') # hi block table position, high 16 bits of the table positions
+
+hash_entry_dtype = np.dtype([
+    ('name1', '<u4'),
+    ('name2', '<u4'),
+    ('locale', '<u2'),
+    ('platform', '<u2'),
+    ('block_index', '<u4'),
+])
+
+block_entry_dtype = np.dtype([
+    ('offset', '<u4'),
+    ('compressed_size', '<u4'),
+    ('file_size', '<u4'),
+    ('flags', '<u4'),
+])
+
+# the os.stat fields used by Manifest : file size, and modification time of the archive holding it
+MpqStat = namedtuple("MpqStat", ["st_size", "st_mtime_ns"])
+
+
+class MpqError(Exception):
+    """Raised when an MPQ archive or one of its files can't be read."""
+
+
+def build_crypt_table():
+    table = [0] * 0x500
+    seed = 0x00100001
+    for index1 in range(0x100):
+        index2 = index1
+        for i in range(5):
+            seed = (seed * 125 + 3) % 0x2AAAAB
+            high = (seed & 0xFFFF) << 0x10
+            seed = (seed * 125 + 3) % 0x2AAAAB
+            table[index2] = high | (seed & 0xFFFF)
+            index2 += 0x100
+    return table
+
+crypt_table = build_crypt_table()
+
+HASH_TABLE_OFFSET = 0
+HASH_NAME_A = 1
+HASH_NAME_B = 2
+HASH_FILE_KEY = 3
+
+def hash_string(name, hash_type):
+    """MPQ hash of a file name, case insensitive and with / and \\ as the same separator."""
+    seed1 = 0x7FED7FED
+    seed2 = 0xEEEEEEEE
+    for char in name.replace('/', '\\').encode('utf-8').upper():
+        seed1 = (crypt_table[(hash_type << 8) + char] ^ (seed1 + seed2)) & 0xFFFFFFFF
+        seed2 = (char + seed1 + seed2 + (seed2 << 5) + 3) & 0xFFFFFFFF
+    return seed1
+
+def decrypt(data, key):
+    """Decrypt the whole 32 bit words of data, trailing bytes are left as is."""
+    word_count = len(data) // 4
+    values = list(struct.unpack_from(f'<{word_count}I', data))
+    seed = 0xEEEEEEEE
+    for i, value in enumerate(values):
+        seed = (seed + crypt_table[0x400 + (key & 0xFF)]) & 0xFFFFFFFF
+        value = (value ^ (key + seed)) & 0xFFFFFFFF
+        values[i] = value
+        key = ((((~key & 0xFFFFFFFF) << 0x15) + 0x11111111) & 0xFFFFFFFF) | (key >> 0x0B)
+        seed = (value + seed + (seed << 5) + 3) & 0xFFFFFFFF
+    return struct.pack(f'<{word_count}I', *values) + bytes(data[word_count * 4:])
+
+def decompress_sector(data, expected_size):
+    compression = data[0]
+    if compression == COMPRESSION_ZLIB:
+        sector = zlib.decompress(data[1:])
+    elif compression == COMPRESSION_BZIP2:
+        sector = bz2.decompress(data[1:])
+    else:
+        raise MpqError(f"Unsupported MPQ sector compression 0x{compression:02X}.")
+    if len(sector) != expected_size:
+        raise MpqError(f"MPQ sector decompressed to {len(sector)} bytes, expected {expected_size}.")
+    return sector
+
+# locale folders and archive name parts of the clients, lower case
+MPQ_LOCALES = frozenset(["dede", "encn", "engb", "enus", "entw", "eses", "esmx", "frfr", "itit",
+                         "kokr", "ptbr", "ptpt", "ruru", "zhcn", "zhtw"])
+
+def patch_suffix_order(suffix):
+    # patch < patch-2 < patch-10 < patch-a < patch-x, then anything else by name
+    if not suffix:
+        return (0, 0, "")
+    if suffix.isdigit():
+        return (1, int(suffix), "")
+    if suffix.isalpha() and len(suffix) == 1:
+        return (2, 0, suffix)
+    return (3, 0, suffix)
+
+def patch_chain_order(path):
+    """Sort key putting archives in client load order : base archives first, then the general patches
+    (patch, patch-2, ..., patch-10, then letter patches patch-a, ..., patch-z), locale patches last
+    (patch-enUS, patch-enUS-2, ...).
+
+    Locale patches are recognized by their locale name part or by their locale folder (e.g. Data/enUS).
+    """
+    name = os.path.splitext(os.path.basename(path))[0].lower()
+    if not name.startswith("patch"):
+        return (0, (0, 0, ""), name, path)
+    parts = [part for part in name[len("patch"):].split("-") if part]
+    is_locale = os.path.basename(os.path.dirname(path)).lower() in MPQ_LOCALES
+    if parts and parts[0] in MPQ_LOCALES:
+        is_locale = True
+        parts = parts[1:]
+    suffix = "-".join(parts)
+    return (2 if is_locale else 1, patch_suffix_order(suffix), name, path)
+
+
+class MpqArchive:
+    """One MPQ archive, its hash and block tables are decrypted once when opened.
+
+    The archive keeps no open file handle, so it can be handed to other
+    processes along with its tables.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        stat = os.stat(path)
+        self.mtime_ns = stat.st_mtime_ns
+
+        with open(path, 'rb') as f:
+            self.archive_offset = self.find_header(f, stat.st_size)
+            f.seek(self.archive_offset)
+            header = f.read(mpq_header_struct.size + mpq_header_v1_struct.size)
+            if len(header) < mpq_header_struct.size:
+                raise MpqError(f"{path} has a truncated MPQ header.")
+            (magic, header_size, archive_size, format_version, sector_size_shift,
+             hash_table_pos, block_table_pos, hash_table_entries, block_table_entries) = mpq_header_struct.unpack_from(header)
+            if format_version > 1:
+                raise MpqError(f"{path} uses MPQ format version {format_version}, only versions 0 and 1 are supported.")
+
+            hi_block_table_pos = 0
+            if format_version == 1:
+                hi_block_table_pos, hash_table_pos_hi, block_table_pos_hi = mpq_header_v1_struct.unpack_from(header, mpq_header_struct.size)
+                hash_table_pos |= hash_table_pos_hi << 32
+                block_table_pos |= block_table_pos_hi << 32
+
+            self.sector_size = 512 << sector_size_shift
+            hash_table = self.read_table(f, hash_table_pos, hash_table_entries, hash_entry_dtype, "(hash table)")
+            block_table = self.read_table(f, block_table_pos, block_table_entries, block_entry_dtype, "(block table)")
+
+            self.block_offsets = block_table['offset'].astype(np.uint64) + self.archive_offset
+            if hi_block_table_pos:
+                f.seek(self.archive_offset + hi_block_table_pos)
+                hi_offsets = np.frombuffer(f.read(block_table_entries * 2), dtype='<u2')
+                self.block_offsets += hi_offsets.astype(np.uint64) << 32
+        self.blocks = block_table
+
+        # both name hashes -> block indices per locale, instead of probing the hash table on each lookup
+        self.entries = {} # key = (name1, name2), value = list of (locale, block index)
+        used = hash_table[hash_table['block_index'] < HASH_ENTRY_DELETED]
+        for name1, name2, locale, block_index in zip(used['name1'].tolist(), used['name2'].tolist(),
+                                                      used['locale'].tolist(), used['block_index'].tolist()):
+            if block_index < block_table_entries:
+                self.entries.setdefault((name1, name2), []).append((locale, block_index))
+
+    @staticmethod
+    def find_header(f, file_size):
+        # the header can follow other data, it is aligned on 512 bytes
+        offset = 0
+        while offset + 16 <= file_size:
+            f.seek(offset)
+            magic, user_data_size, header_offset = struct.unpack('<4sII', f.read(12))
+            if magic == b'MPQ\x1a':
+                return offset
+            if magic == b'MPQ\x1b': # user data block pointing at the header
+                return offset + header_offset
+            offset += 0x200
+        raise MpqError(f"{f.name} is not an MPQ archive.")
+
+    def read_table(self, f, position, entries, dtype, key_name):
+        f.seek(self.archive_offset + position)
+        data = f.read(entries * dtype.itemsize)
+        if len(data) != entries * dtype.itemsize:
+            raise MpqError(f"{self.path} {key_name} is truncated.")
+        return np.frombuffer(decrypt(data, hash_string(key_name, HASH_FILE_KEY)), dtype=dtype)
+
+    def find_block(self, name):
+        """Block index of a file, preferring the neutral locale, or None."""
+        entries = self.entries.get((hash_string(name, HASH_NAME_A), hash_string(name, HASH_NAME_B)))
+        if not entries:
+            return None
+        for locale, block_index in entries:
+            if locale == 0:
+                return block_index
+        return entries[0][1]
+
+    def stat(self, block_index):
+        return MpqStat(int(self.blocks[block_index]['file_size']), self.mtime_ns)
+
+    def is_deleted(self, block_index):
+        flags = int(self.blocks[block_index]['flags'])
+        return not flags & MPQ_FILE_EXISTS or bool(flags & MPQ_FILE_DELETE_MARKER)
+
+    def read_block(self, name, block_index):
+        offset, compressed_size, file_size, flags = (int(value) for value in self.blocks[block_index])
+        if flags & MPQ_FILE_PATCH_FILE:
+            raise MpqError(f"{name} is an incremental patch file in {self.path}, not supported.")
+        if flags & MPQ_FILE_IMPLODE:
+            raise MpqError(f"{name} uses PKWARE implode compression in {self.path}, not supported.")
+
+        with open(self.path, 'rb') as f:
+            f.seek(int(self.block_offsets[block_index]))
+            data = f.read(compressed_size)
+        if len(data) != compressed_size:
+            raise MpqError(f"{name} is truncated in {self.path}.")
+
+        key = None
+        if flags & MPQ_FILE_ENCRYPTED:
+            key = hash_string(name.replace('/', '\\').rsplit('\\', 1)[-1], HASH_FILE_KEY)
+            if flags & MPQ_FILE_FIX_KEY:
+                key = ((key + offset) ^ file_size) & 0xFFFFFFFF
+
+        if flags & MPQ_FILE_SINGLE_UNIT:
+            if key is not None:
+                data = decrypt(data, key)
+            if flags & MPQ_FILE_COMPRESS and compressed_size < file_size:
+                data = decompress_sector(data, file_size)
+            return data
+
+        sector_count = (file_size + self.sector_size - 1) // self.sector_size
+        if not flags & MPQ_FILE_COMPRESS:
+            if key is None:
+                return data[:file_size]
+            return b''.join(decrypt(data[i * self.sector_size : (i + 1) * self.sector_size], (key + i) & 0xFFFFFFFF)
+                            for i in range(sector_count))
+
+        # sector offset table, relative to the start of the file, with one more entry for the sector checksums
+        table_size = (sector_count + 1 + bool(flags & MPQ_FILE_SECTOR_CRC)) * 4
+        offsets_data = data[:table_size]
+        if key is not None:
+            offsets_data = decrypt(offsets_data, (key - 1) & 0xFFFFFFFF)
+        sector_offsets = struct.unpack_from(f'<{sector_count + 1}I', offsets_data)
+
+        sectors = []
+        for i in range(sector_count):
+            sector = data[sector_offsets[i] : sector_offsets[i + 1]]
+            if key is not None:
+                sector = decrypt(sector, (key + i) & 0xFFFFFFFF)
+            expected_size = min(self.sector_size, file_size - i * self.sector_size)
+            if len(sector) < expected_size:
+                sector = decompress_sector(sector, expected_size)
+            sectors.append(sector)
+        return b''.join(sectors)
+
+    def read_file(self, name):
+        block_index = self.find_block(name)
+        if block_index is None or self.is_deleted(block_index):
+            raise FileNotFoundError(f"{name} is not in {self.path}.")
+        return self.read_block(name, block_index)
+
+
+class MpqChain:
+    """Archives read as one file system, archives later in the chain override earlier ones like client patches.
+
+    Use from_paths or from_folder to sort archives in client load order.
+    """
+
+    def __init__(self, archives):
+        self.archives = list(archives)
+
+    @classmethod
+    def from_paths(cls, paths):
+        return cls(MpqArchive(path) for path in sorted(paths, key=patch_chain_order))
+
+    @classmethod
+    def from_folder(cls, folder):
+        paths = []
+        for root, dirs, files in os.walk(folder):
+            paths.extend(os.path.join(root, filename) for filename in files if filename.lower().endswith(MPQ_EXTENSION))
+        return cls.from_paths(paths)
+
+    def find(self, name):
+        """(archive, block index) of the highest priority version of a file, or None if missing or deleted by a patch."""
+        for archive in reversed(self.archives):
+            block_index = archive.find_block(name)
+            if block_index is None:
+                continue
+            if archive.is_deleted(block_index):
+                return None
+            return archive, block_index
+        return None
+
+    def has_file(self, name):
+        return self.find(name) is not None
+
+    def stat(self, name):
+        """File size and modification time of the archive holding the file, for manifests."""
+        found = self.find(name)
+        if found is None:
+            raise FileNotFoundError(f"{name} is not in the MPQ archives.")
+        archive, block_index = found
+        return archive.stat(block_index)
+
+    def read_file(self, name):
+        found = self.find(name)
+        if found is None:
+            raise FileNotFoundError(f"{name} is not in the MPQ archives.")
+        archive, block_index = found
+        return archive.read_block(name, block_index)
@@ -0,0 +1,173 @@
+"""Optional sinks writing alphamaps produced by AdtFile.iter_alphamaps to disk."""
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+OUTPUT_FORMATS = ("png", "r8", "tga", "npz")
+
+# "adaptive" lets Pillow pick a filter per row, the others are applied to every row by encode_png
+PNG_FILTERS = {"none": 0, "sub": 1, "up": 2, "adaptive": None}
+
+
+def alphamap_filename(map_name, x, y, texture_name, extension=".png"):
+    """Output name of a texture alphamap, e.g. 'Azeroth_33_55-Grass01.png'."""
+    filename = os.path.basename(texture_name)
+    basename = os.path.splitext(filename)[0]
+    return f"{map_name}_{x}_{y}-{basename}{extension}"
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+def encode_png(alphamap, compress_level=6, png_filter="none"):
+    """Encode a uint8 2D array as an 8 bit grayscale png using the same filter for every row."""
+    height, width = alphamap.shape
+    filter_type = PNG_FILTERS[png_filter]
+
+    rows = np.empty((height, width + 1), dtype=np.uint8)
+    rows[:, 0] = filter_type
+    if png_filter == "sub": # difference with the pixel on the left, wraps around like the png spec expects
+        rows[:, 1] = alphamap[:, 0]
+        np.subtract(alphamap[:, 1:], alphamap[:, :-1], out=rows[:, 2:])
+    elif png_filter == "up": # difference with the pixel above
+        rows[0, 1:] = alphamap[0]
+        np.subtract(alphamap[1:], alphamap[:-1], out=rows[1:, 1:])
+    else:
+        rows[:, 1:] = alphamap
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0) # 8 bit grayscale, no interlace
+    return (b'\x89PNG\r\n\x1a\n'
+            + png_chunk(b'IHDR', header)
+            + png_chunk(b'IDAT', zlib.compress(rows.tobytes(), compress_level))
+            + png_chunk(b'IEND', b''))
+
+def save_png(alphamap, output_path, compress_level=6, png_filter="adaptive"):
+    """Save a 1024x1024 uint8 alphamap as an 8 bit grayscale png."""
+    if png_filter == "adaptive":
+        img = Image.fromarray(alphamap, mode="L")
+        img.save(output_path, compress_level=compress_level)
+    else:
+        with open(output_path, 'wb') as f:
+            f.write(encode_png(alphamap, compress_level, png_filter))
+
+def save_r8(alphamap, output_path):
+    """Save an alphamap as raw 8 bit values, row by row with no header."""
+    alphamap.tofile(output_path)
+
+def save_tga(alphamap, output_path):
+    """Save an alphamap as an uncompressed 8 bit grayscale tga."""
+    img = Image.fromarray(alphamap, mode="L")
+    img.save(output_path, format="TGA")
+
+def write_png_files(adt, output_root, skip_unreferenced=False):
+    """Write every texture alphamap of an AdtFile in output_root, return the written paths."""
+    os.makedirs(output_root, exist_ok=True)
+    output_paths = []
+    for texture_name, alphamap in adt.iter_alphamaps(skip_unreferenced):
+        save_name = alphamap_filename(adt.map_name, adt.x, adt.y, texture_name)
+        output_path = os.path.join(output_root, save_name)
+        save_png(alphamap, output_path)
+        output_paths.append(output_path)
+    return output_paths
+
+
+class AlphamapWriter:
+    """Encode and write the alphamaps of ADTs, encoding runs on a thread pool.
+
+    zlib releases the GIL, so png encoding scales with threads while the
+    calling thread keeps assembling the next alphamaps.
+
+    output_format:
+        "png" one grayscale png per texture,
+        "r8"  one raw 1024x1024 8 bit file per texture,
+        "tga" one uncompressed grayscale tga per texture,
+        "npz" one uncompressed numpy archive per ADT, keyed by texture file name.
+    """
+
+    def __init__(self, output_format="png", threads=1, compress_level=6, png_filter="adaptive", skip_unreferenced=False):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}.")
+        if png_filter not in PNG_FILTERS:
+            raise ValueError(f"Unknown png filter '{png_filter}', expected one of {tuple(PNG_FILTERS)}.")
+        self.output_format = output_format
+        self.threads = max(1, threads)
+        self.compress_level = compress_level
+        self.png_filter = png_filter
+        self.skip_unreferenced = skip_unreferenced
+        self.executor = ThreadPoolExecutor(max_workers=self.threads) if self.threads > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def save(self, alphamap, output_path):
+        """Encode and write one alphamap in the writer's format."""
+        if self.output_format == "png":
+            save_png(alphamap, output_path, self.compress_level, self.png_filter)
+        elif self.output_format == "r8":
+            save_r8(alphamap, output_path)
+        elif self.output_format == "tga":
+            save_tga(alphamap, output_path)
+
+    def write(self, adt, output_root, metrics=None):
+        """Write every texture alphamap of an AdtFile in output_root, return the written paths.
+
+        If a Metrics is given, the encode stage (with the written bytes) and the outputs counter are recorded in it.
+        """
+        start_time = time.perf_counter()
+        output_paths = self.write_files(adt, output_root)
+        if metrics is not None:
+            written_bytes = sum(os.path.getsize(output_path) for output_path in output_paths)
+            metrics.add("encode", time.perf_counter() - start_time, written_bytes)
+            metrics.count("outputs", len(output_paths))
+        return output_paths
+
+    def write_files(self, adt, output_root):
+        os.makedirs(output_root, exist_ok=True)
+
+        if self.output_format == "npz":
+            layers = {}
+            for texture_name, alphamap in adt.iter_alphamaps(self.skip_unreferenced):
+                key = os.path.splitext(os.path.basename(texture_name))[0]
+                while key in layers: # same file name in two texture folders
+                    key += "_"
+                layers[key] = alphamap
+            output_path = os.path.join(output_root, f"{adt.map_name}_{adt.x}_{adt.y}.npz")
+            np.savez(output_path, **layers)
+            return [output_path]
+
+        extension = "." + self.output_format
+        output_paths = []
+        pending = deque()
+        # bound the alphamaps waiting to be encoded, so memory stays at a few images per thread
+        max_pending = self.threads * 2
+
+        for texture_name, alphamap in adt.iter_alphamaps(self.skip_unreferenced):
+            save_name = alphamap_filename(adt.map_name, adt.x, adt.y, texture_name, extension)
+            output_path = os.path.join(output_root, save_name)
+            output_paths.append(output_path)
+
+            if self.executor is None:
+                self.save(alphamap, output_path)
+                continue
+
+            pending.append(self.executor.submit(self.save, alphamap, output_path))
+            if len(pending) >= max_pending:
+                pending.popleft().result()
+
+        while pending:
+            pending.popleft().result()
+
+        return output_paths
@@ -0,0 +1,79 @@
+"""Streaming pipeline running each stage of an export on its own thread, with bounded queues in between."""
+import queue
+import threading
+
+END = object() # marks the end of the items in a queue
+
+
+class StageError:
+    """An exception raised by a stage, passed down the queues to the consumer."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def run_pipeline(items, stages, depths):
+    """Yield items passed through every stage function, in order.
+
+    Each stage runs on its own thread and gets the value returned by the
+    previous stage (the item itself for the first one). depths[i] bounds the
+    values done by stage i and waiting for the next stage (or the consumer),
+    so at most sum(depths) + len(stages) items are in flight at once. Slow
+    disks and busy CPUs overlap as long as the queues are neither empty nor full.
+
+    An exception raised by a stage stops the pipeline and is raised again by
+    the consumer, stages are expected to handle per item failures themselves.
+    """
+    if len(depths) != len(stages):
+        raise ValueError(f"Expected one queue depth per stage, got {len(depths)} for {len(stages)} stages.")
+    queues = [queue.Queue(maxsize=max(1, depth)) for depth in depths]
+    stopped = threading.Event()
+
+    def put(target, value):
+        # gives up when the consumer is gone, instead of blocking on a full queue forever
+        while not stopped.is_set():
+            try:
+                target.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def iter_queue(source):
+        while True:
+            try:
+                value = source.get(timeout=0.1)
+            except queue.Empty:
+                if stopped.is_set():
+                    return
+                continue
+            if value is END:
+                return
+            yield value
+
+    def run_stage(stage, source, target):
+        try:
+            for value in source:
+                if isinstance(value, StageError):
+                    put(target, value)
+                    return
+                if not put(target, stage(value)):
+                    return
+        except Exception as e:
+            put(target, StageError(e))
+            return
+        put(target, END)
+
+    sources = [iter(items)] + [iter_queue(stage_queue) for stage_queue in queues[:-1]]
+    threads = [threading.Thread(target=run_stage, args=(stage, source, target), daemon=True)
+               for stage, source, target in zip(stages, sources, queues)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for value in iter_queue(queues[-1]):
+            if isinstance(value, StageError):
+                raise value.error
+            yield value
+    finally:
+        stopped.set()
@@ -0,0 +1,177 @@
+"""Watch mode helpers : polling input folders for saved files, and a local http endpoint to trigger exports."""
+import json
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WATCHED_EXTENSIONS = (".adt", ".wdt")
+
+
+class FolderWatcher:
+    """Find files of input folders which were created or modified since the last poll.
+
+    Editors write a file in several steps, so a modified file is only
+    reported once its size and mtime stayed the same for debounce seconds.
+    """
+
+    def __init__(self, paths, extensions=WATCHED_EXTENSIONS, interval=0.2, debounce=0.3):
+        self.paths = list(paths)
+        self.extensions = extensions
+        self.interval = interval
+        self.debounce = debounce
+        self.signatures = self.scan() # key = str filepath, value = (size, mtime_ns) when last reported
+        self.pending = {} # key = str filepath, value = ((size, mtime_ns), float time it was last seen changing)
+        self.watched_files = tuple(sorted(self.signatures)) # replaced after each poll, read by other threads
+
+    def scan(self):
+        signatures = {}
+        for path in self.paths:
+            if os.path.isdir(path):
+                filepaths = (os.path.join(root, filename) for root, dirs, files in os.walk(path) for filename in files)
+            else:
+                filepaths = [path]
+            for filepath in filepaths:
+                if not filepath.lower().endswith(self.extensions):
+                    continue
+                try:
+                    stat = os.stat(filepath)
+                except OSError: # deleted while scanning
+                    continue
+                signatures[filepath] = (stat.st_size, stat.st_mtime_ns)
+        return signatures
+
+    def files(self):
+        """Every watched file currently on disk."""
+        return sorted(self.signatures)
+
+    def poll(self):
+        """Return the files whose changes have settled since the last poll, WDTs first."""
+        now = time.monotonic()
+        current = self.scan()
+        ready = []
+        for filepath, signature in current.items():
+            if self.signatures.get(filepath) == signature:
+                self.pending.pop(filepath, None) # changed back, e.g. saved and restored
+                continue
+            pending_signature, changed_time = self.pending.get(filepath, (None, now))
+            if pending_signature != signature:
+                self.pending[filepath] = (signature, now)
+            elif now - changed_time >= self.debounce:
+                del self.pending[filepath]
+                self.signatures[filepath] = signature
+                ready.append(filepath)
+
+        for filepath in set(self.signatures) - set(current):
+            del self.signatures[filepath]
+        for filepath in set(self.pending) - set(current):
+            del self.pending[filepath]
+        self.watched_files = tuple(sorted(self.signatures))
+        return sorted(ready, key=lambda filepath: (not filepath.lower().endswith(".wdt"), filepath))
+
+
+    def resolve(self, path):
+        """Watched files a requested path refers to, empty if none.
+
+        path can be a file path, a path relative to one of the watched
+        folders, or a file name (matched without case in every watched folder).
+        """
+        watched_files = self.watched_files
+        full_path = os.path.normcase(os.path.abspath(path))
+        found = [filepath for filepath in watched_files if os.path.normcase(os.path.abspath(filepath)) == full_path]
+        if found:
+            return found
+        if os.path.isfile(path) and path.lower().endswith(self.extensions):
+            return [path]
+
+        relative_path = os.path.normcase(os.path.normpath(path.replace("\\", "/")))
+        found = [filepath for filepath in watched_files for folder in self.paths
+                 if os.path.isdir(folder) and os.path.normcase(os.path.relpath(filepath, folder)) == relative_path]
+        if found:
+            return found
+        filename = os.path.basename(path.replace("\\", "/")).lower()
+        return [filepath for filepath in watched_files if os.path.basename(filepath).lower() == filename]
+
+
+class WatchServer:
+    """Local http endpoint of the watch mode, served from a background thread.
+
+    GET /status returns the status set with update_status() as json.
+    POST /export queues an export request, with an optional json body
+    {"paths": [...], "force": false}, no paths meaning every watched file.
+    Given paths are turned into file paths with resolve(path), which returns
+    the matching files, paths it can't resolve are listed as "unknown" in the
+    response and a request resolving none of them is refused.
+    Requests are read from the triggers queue as (paths, force) tuples.
+    """
+
+    def __init__(self, port, resolve, host="127.0.0.1"):
+        self.triggers = queue.Queue()
+        self.lock = threading.Lock()
+        self.status = {}
+
+        watch_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(self, code, content):
+                body = json.dumps(content, indent=1).encode('utf-8')
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/status":
+                    self.send_json(404, {"error": "GET /status or POST /export"})
+                    return
+                with watch_server.lock:
+                    status = json.loads(json.dumps(watch_server.status))
+                status["queued_requests"] = watch_server.triggers.qsize()
+                self.send_json(200, status)
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/export":
+                    self.send_json(404, {"error": "GET /status or POST /export"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                    paths = [str(path) for path in request.get("paths", [])]
+                    force = bool(request.get("force", False))
+                except (ValueError, TypeError, AttributeError) as e:
+                    self.send_json(400, {"error": f"Expected a json object with paths and force : {e}"})
+                    return
+
+                filepaths = []
+                unknown_paths = []
+                for path in paths:
+                    found = resolve(path)
+                    if found:
+                        filepaths.extend(filepath for filepath in found if filepath not in filepaths)
+                    else:
+                        unknown_paths.append(path)
+                if paths and not filepaths:
+                    self.send_json(404, {"error": "None of the paths is a watched file.", "unknown": unknown_paths})
+                    return
+                watch_server.triggers.put((filepaths, force))
+                self.send_json(202, {"queued": filepaths or "all", "unknown": unknown_paths, "force": force})
+
+            def log_message(self, format, *args):
+                pass # requests are not worth a console line
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.address = f"http://{host}:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def update_status(self, **values):
+        with self.lock:
+            self.status.update(values)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
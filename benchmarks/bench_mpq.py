@@ -0,0 +1,151 @@
+"""Checks and micro-benchmark of the MPQ reader.
+
+Builds archives with every storage mode of synthetic_mpq (compressed sectors,
+sector checksums, encryption with and without MPQ_FILE_FIX_KEY, single unit
+files, delete markers) and checks each file reads back as written, then
+checks the patch chain order and overrides, and reading a synthetic map
+from a patched chain. Finally times reading the ADTs of an archive per mode.
+
+Usage : python benchmarks/bench_mpq.py [ADT count] [iterations]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from alphamaps import AdtFile, MpqArchive, MpqChain, WdtFile
+from alphamaps.mpq import patch_chain_order
+from synthetic import make_adt, make_wdt
+from synthetic_mpq import MPQ_MODES, write_mpq
+
+SECTOR_SIZE = 4096 # synthetic_mpq default sector size shift of 3
+
+
+def make_contents(rng):
+    """File contents covering sector boundaries, compressible or not."""
+    noise = rng.integers(0, 256, 3 * SECTOR_SIZE + 100, dtype=np.uint8).tobytes()
+    runs = np.repeat(rng.integers(0, 256, 400, dtype=np.uint8), 32).tobytes()
+    return {
+        "empty": b'',
+        "byte": b'x',
+        "odd": noise[:4099],
+        "one_sector": runs[:SECTOR_SIZE],
+        "runs": runs,
+        "noise": noise,
+        "mixed": runs[:SECTOR_SIZE + 10] + noise[:SECTOR_SIZE] + runs[:7],
+    }
+
+def check_modes(folder, rng):
+    contents = make_contents(rng)
+    for mode in MPQ_MODES:
+        if mode == "delete":
+            continue
+        files = [(f"Data\\{mode}\\{key}.bin", data, mode) for key, data in contents.items()]
+        for prefix_size, user_data in ((0, False), (0x400, False), (0, True)):
+            path = os.path.join(folder, f"{mode}_{prefix_size}_{user_data}.mpq")
+            write_mpq(path, files, prefix_size=prefix_size, user_data=user_data)
+            archive = MpqArchive(path)
+            for name, data, _ in files:
+                assert archive.read_file(name) == data, (mode, name, prefix_size, user_data)
+                # names are matched without case and with either separator
+                assert archive.read_file(name.lower().replace('\\', '/')) == data, (mode, name)
+            try:
+                archive.read_file("Data\\missing.bin")
+                raise AssertionError("missing file was found")
+            except FileNotFoundError:
+                pass
+
+def check_patch_order():
+    paths = ["Data/enUS/patch-enUS-2.MPQ", "Data/patch-x.MPQ", "Data/patch-10.MPQ", "Data/enUS/patch-enUS.MPQ",
+             "Data/patch.MPQ", "Data/patch-A.MPQ", "Data/lichking.MPQ", "Data/enUS/patch-x.MPQ", "Data/common.MPQ",
+             "Data/patch-2.MPQ", "Data/patch-a.MPQ", "Data/enUS/locale-enUS.MPQ"]
+    order = [os.path.basename(os.path.dirname(path)) + "/" + os.path.basename(path) for path in sorted(paths, key=patch_chain_order)]
+    assert order == ["Data/common.MPQ", "Data/lichking.MPQ", "enUS/locale-enUS.MPQ",
+                     "Data/patch.MPQ", "Data/patch-2.MPQ", "Data/patch-10.MPQ", "Data/patch-A.MPQ", "Data/patch-a.MPQ", "Data/patch-x.MPQ",
+                     "enUS/patch-enUS.MPQ", "enUS/patch-enUS-2.MPQ", "enUS/patch-x.MPQ"], order
+
+def check_patch_chain(folder):
+    data_folder = os.path.join(folder, "Data")
+    write_mpq(os.path.join(data_folder, "common.MPQ"), [
+        ("base.txt", b'base of common', "zlib"),
+        ("deleted.txt", b'deleted by patch', "zlib"),
+        ("restored.txt", b'deleted then added again', "zlib"),
+        ("patched.txt", b'common', "zlib"),
+    ])
+    write_mpq(os.path.join(data_folder, "patch.MPQ"), [
+        ("deleted.txt", b'', "delete"),
+        ("restored.txt", b'', "delete"),
+        ("patched.txt", b'patch', "encrypted"),
+    ])
+    write_mpq(os.path.join(data_folder, "patch-2.MPQ"), [
+        ("restored.txt", b'restored by patch-2', "single"),
+        ("patched.txt", b'patch-2', "fix_key"),
+    ])
+    write_mpq(os.path.join(data_folder, "patch-x.MPQ"), [("patched.txt", b'patch-x', "bzip2")])
+    write_mpq(os.path.join(data_folder, "enUS", "patch-enUS.MPQ"), [("patched.txt", b'patch-enUS', "raw")])
+
+    chain = MpqChain.from_folder(folder)
+    assert [os.path.basename(archive.path) for archive in chain.archives] == \
+        ["common.MPQ", "patch.MPQ", "patch-2.MPQ", "patch-x.MPQ", "patch-enUS.MPQ"]
+    assert chain.read_file("base.txt") == b'base of common'
+    assert not chain.has_file("deleted.txt")
+    try:
+        chain.read_file("deleted.txt")
+        raise AssertionError("deleted file was read")
+    except FileNotFoundError:
+        pass
+    assert chain.read_file("restored.txt") == b'restored by patch-2'
+    assert chain.read_file("patched.txt") == b'patch-enUS'
+    assert chain.stat("patched.txt").st_size == len(b'patch-enUS')
+
+def check_map(folder):
+    map_folder = "World\\Maps\\Syn\\"
+    wdt_data = make_wdt(True, [(32, 32), (33, 32)])
+    adts = {(x, y): make_adt("compressed", 6, 4, seed) for seed, (x, y) in enumerate([(32, 32), (33, 32)])}
+    write_mpq(os.path.join(folder, "Data", "common.MPQ"),
+              [(map_folder + "Syn.wdt", wdt_data, "zlib")]
+              + [(f"{map_folder}Syn_{x}_{y}.adt", data, "zlib") for (x, y), data in adts.items()])
+    patched_adt = make_adt("compressed", 6, 4, 100)
+    write_mpq(os.path.join(folder, "Data", "patch.MPQ"), [(f"{map_folder}Syn_33_32.adt", patched_adt, "fix_key")])
+
+    chain = MpqChain.from_folder(folder)
+    wdt = WdtFile(chain.read_file(map_folder + "Syn.wdt"), "Syn")
+    assert wdt.big_alpha and sorted(wdt.adt_coords) == [(32, 32), (33, 32)]
+    adts[(33, 32)] = patched_adt
+    for (x, y), data in adts.items():
+        adt_data = chain.read_file(f"{map_folder}Syn_{x}_{y}.adt")
+        assert adt_data == data
+        adt = AdtFile(adt_data, "Syn", x, y, wdt.big_alpha)
+        adt.decode_alphamaps()
+        assert len(adt.textures) == 6
+
+
+def main():
+    adt_count = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as folder:
+        # the reader is only timed if it reads back every archive layout
+        check_modes(os.path.join(folder, "modes"), rng)
+        check_patch_order()
+        check_patch_chain(os.path.join(folder, "chain"))
+        check_map(os.path.join(folder, "map"))
+        print("MPQ reader checks passed.")
+
+        adts = [(f"World\\Maps\\Syn\\Syn_{32 + i % 8}_{32 + i // 8}.adt", make_adt("compressed", 8, 4, i)) for i in range(adt_count)]
+        total_size = sum(len(data) for name, data in adts)
+        for mode in ("raw", "zlib", "bzip2", "encrypted", "single"):
+            path = os.path.join(folder, f"bench_{mode}.mpq")
+            write_mpq(path, [(name, data, mode) for name, data in adts])
+            archive = MpqArchive(path)
+            seconds = timeit.timeit(lambda: [archive.read_file(name) for name, data in adts], number=iterations) / iterations
+            print(f"{adt_count} ADTs {mode:9} : {seconds * 1000:8.2f} ms, {total_size / seconds / 1e6:7.1f} MB/s "
+                  f"({os.path.getsize(path) / total_size:5.1%} of the ADT size)")
+
+
+if __name__ == "__main__":
+    main()
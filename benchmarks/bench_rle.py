@@ -0,0 +1,67 @@
+"""Micro-benchmark of the compressed big alpha (MCAL RLE) decoder.
+
+Compares decompress_alpha_map against the previous implementation, which read
+the stream one byte at a time from the file and grew a Python list.
+
+Usage : python benchmarks/bench_rle.py [iterations]
+"""
+import io
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from alphamaps import decompress_alpha_map
+from synthetic import compress_alpha_map
+
+
+def legacy_decompress_alpha_map(f):
+    """Previous decoder, kept as reference : one f.read(1) per command byte and a growing list."""
+    raw_alphamap_data = []
+    while len(raw_alphamap_data) < 4096:
+        cmd_byte = f.read(1)
+        if not cmd_byte:
+            raise EOFError("Unexpected end of file while decoding alpha map")
+
+        cmd = cmd_byte[0]
+        fill_mode = (cmd & 0x80) != 0
+        count = cmd & 0x7F
+
+        if fill_mode:
+            fill_byte = f.read(1)
+            raw_alphamap_data.extend([fill_byte[0]] * count)
+        else:
+            copy_bytes = f.read(count)
+            raw_alphamap_data.extend(copy_bytes[i] for i in range(count))
+
+    return np.array(raw_alphamap_data[:4096], dtype=np.uint8)
+
+
+def make_alpha_maps():
+    rng = np.random.default_rng(0)
+    smooth = np.repeat(rng.integers(0, 256, 64, dtype=np.uint8), 64) # long fill runs, typical painted terrain
+    noisy = rng.integers(0, 256, 4096, dtype=np.uint8) # copy runs only, worst case
+    mixed = smooth.copy()
+    mixed[1024:2048] = noisy[1024:2048]
+    return {"smooth": smooth, "noisy": noisy, "mixed": mixed}
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    for name, alphamap_data in make_alpha_maps().items():
+        compressed = compress_alpha_map(alphamap_data)
+        # decoders are only compared if they agree on the output
+        assert (decompress_alpha_map(compressed) == alphamap_data).all()
+        assert (legacy_decompress_alpha_map(io.BytesIO(compressed)) == alphamap_data).all()
+
+        legacy_time = timeit.timeit(lambda: legacy_decompress_alpha_map(io.BytesIO(compressed)), number=iterations) / iterations
+        new_time = timeit.timeit(lambda: decompress_alpha_map(compressed), number=iterations) / iterations
+
+        print(f"{name:>8} ({len(compressed)} bytes) : legacy {legacy_time * 1e6:8.1f} us, "
+              f"decompress_alpha_map {new_time * 1e6:8.1f} us, {legacy_time / new_time:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
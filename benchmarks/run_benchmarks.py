@@ -0,0 +1,116 @@
+"""Benchmark the ADT export hot paths on synthetic maps.
+
+Each scenario (alpha format, texture count, layer count) is generated in a
+temporary folder and run in a fresh process so its peak RSS is its own.
+Phases timed per ADT :
+    read     reading the file,
+    header   MVER/MHDR/MTEX/MCIN and MCNK headers (AdtFile constructor),
+    mcnk     MCNK walk and MCLY entries (read_layers),
+    decode   alphamap decoding (decode_layers),
+    layer0   layer 0 derivation for all MCNKs (composite_layers),
+    encode   alphamap assembly, encoding and writing (AlphamapWriter.write).
+
+Usage : python benchmarks/run_benchmarks.py [-adts N] [-textures N] [-layers N] [-formats small,big,compressed] [-format png|r8|tga|npz]
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from alphamaps import AdtFile, AlphamapWriter, parse_adt_name
+from synthetic import ALPHA_FORMATS, write_map
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+PHASES = ("read", "header", "mcnk", "decode", "layer0", "encode")
+
+
+def peak_rss_mb():
+    if resource is None:
+        return float("nan")
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+def run_scenario(alpha_format, adt_count, num_textures, max_layers, output_format):
+    """Export a synthetic map, return (phase timings in seconds, source bytes, peak RSS in MB)."""
+    timings = dict.fromkeys(PHASES, 0.0)
+    source_bytes = 0
+
+    with tempfile.TemporaryDirectory() as folder:
+        adt_paths = write_map(os.path.join(folder, "input"), "Synthetic", alpha_format, adt_count, num_textures, max_layers)
+        output_root = os.path.join(folder, "output")
+        big_alpha = alpha_format != "small"
+
+        with AlphamapWriter(output_format) as writer:
+            for adt_path in adt_paths:
+                map_name, x, y = parse_adt_name(adt_path)
+
+                start = time.perf_counter()
+                with open(adt_path, 'rb') as f:
+                    data = f.read()
+                source_bytes += len(data)
+                phase_start = time.perf_counter()
+                timings["read"] += phase_start - start
+
+                adt = AdtFile(data, map_name, x, y, big_alpha)
+                phase_end = time.perf_counter()
+                timings["header"] += phase_end - phase_start
+                phase_start = phase_end
+
+                chunks = adt.read_layers()
+                phase_end = time.perf_counter()
+                timings["mcnk"] += phase_end - phase_start
+                phase_start = phase_end
+
+                layer_tex_ids, layer_alphas = adt.decode_layers(chunks)
+                phase_end = time.perf_counter()
+                timings["decode"] += phase_end - phase_start
+                phase_start = phase_end
+
+                adt.composite_layers(layer_tex_ids, layer_alphas)
+                phase_end = time.perf_counter()
+                timings["layer0"] += phase_end - phase_start
+                phase_start = phase_end
+
+                writer.write(adt, output_root)
+                timings["encode"] += time.perf_counter() - phase_start
+
+    return timings, source_bytes, peak_rss_mb()
+
+def main():
+    settings = {"-adts": "8", "-textures": "8", "-layers": "4", "-formats": ",".join(ALPHA_FORMATS), "-format": "png"}
+    args = iter(sys.argv[1:])
+    for arg in args:
+        if arg not in settings:
+            print(__doc__)
+            return
+        settings[arg] = next(args, settings[arg])
+
+    adt_count = int(settings["-adts"])
+    num_textures = int(settings["-textures"])
+    max_layers = int(settings["-layers"])
+    output_format = settings["-format"]
+
+    print(f"{adt_count} ADTs per scenario, {num_textures} textures, up to {max_layers} layers per MCNK, {output_format} output.")
+    print(f"{'alpha':<11}" + "".join(f"{phase:>9}" for phase in PHASES) + f"{'ADTs/s':>9}{'MB/s':>9}{'peak MB':>9}")
+
+    for alpha_format in settings["-formats"].split(","):
+        # fresh process per scenario, for its own peak RSS
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            timings, source_bytes, peak_rss = executor.submit(
+                run_scenario, alpha_format, adt_count, num_textures, max_layers, output_format).result()
+
+        total_time = sum(timings.values())
+        print(f"{alpha_format:<11}"
+              + "".join(f"{timings[phase] / adt_count * 1000:>7.1f}ms" for phase in PHASES)
+              + f"{adt_count / total_time:>9.1f}{source_bytes / total_time / (1024 * 1024):>9.1f}{peak_rss:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Synthetic version 18 WDT and ADT files, for benchmarks.
+
+Only the chunks read by the alphamaps package are written : MVER, MHDR, MTEX,
+MCIN and MCNKs holding MCLY and MCAL, WDTs have MVER, MPHD and MAIN.
+
+alpha_format:
+    "small"      4 bit alphamaps (2048 bytes per layer),
+    "big"        uncompressed 8 bit alphamaps (4096 bytes per layer),
+    "compressed" RLE compressed 8 bit alphamaps.
+"""
+import os
+import struct
+
+import numpy as np
+
+ALPHA_FORMATS = ("small", "big", "compressed")
+MCNK_HEADER_SIZE = 128
+
+
+def chunk(magic, data):
+    """Chunk with its magic reversed, as stored in the files."""
+    return magic[::-1] + struct.pack('I', len(data)) + data
+
+def compress_alpha_map(alphamap_data):
+    """Encode 4096 alpha values the way the client does : fill runs of repeated values, copy the rest."""
+    data = bytes(alphamap_data)
+    compressed = bytearray()
+    i = 0
+    while i < len(data):
+        run_end = i
+        while run_end < len(data) and data[run_end] == data[i] and run_end - i < 127:
+            run_end += 1
+        if run_end - i >= 3:
+            compressed += bytes([0x80 | (run_end - i), data[i]])
+            i = run_end
+        else:
+            copy_end = min(i + 127, len(data))
+            compressed += bytes([copy_end - i]) + data[i:copy_end]
+            i = copy_end
+    return bytes(compressed)
+
+def pack_small_alpha(alphamap_data):
+    """Pack 4096 8 bit alpha values into 2048 bytes of 4 bit values, low nibble first."""
+    values = (np.asarray(alphamap_data, dtype=np.uint8) >> 4).ravel()
+    return (values[0::2] | (values[1::2] << 4)).astype(np.uint8).tobytes()
+
+def make_layer_alphas(rng, num_layers):
+    """Smooth painted looking alphamaps for layers 1.., summing to at most 255 with layer 0."""
+    # low resolution random weights, upscaled so there are runs like in real terrain painting
+    weights = rng.random((num_layers, 8, 8)) ** 2
+    weights = np.kron(weights, np.ones((8, 8)))
+    weights /= weights.sum(axis=0)
+    return (weights[1:] * 255).astype(np.uint8)
+
+def make_adt(alpha_format="big", num_textures=8, max_layers=4, seed=0, do_not_fix_alpha_map=False):
+    """Return the bytes of an ADT whose MCNKs use 1 to max_layers random textures."""
+    if alpha_format not in ALPHA_FORMATS:
+        raise ValueError(f"Unknown alpha format '{alpha_format}', expected one of {ALPHA_FORMATS}.")
+    rng = np.random.default_rng(seed)
+    max_layers = max(1, min(max_layers, 4, num_textures))
+
+    textures = [f"Tileset\\Synthetic\\Synthetic{i:02d}.blp" for i in range(num_textures)]
+    mtex_chunk = chunk(b'MTEX', b''.join(texture.encode() + b'\x00' for texture in textures))
+
+    mhdr_size = 64
+    mtex_offset = 12 + 8 + mhdr_size
+    mcin_offset = mtex_offset + len(mtex_chunk)
+    mcnk_offset = mcin_offset + 8 + 256 * 16
+
+    mcin_entries = []
+    mcnk_chunks = []
+    for index_y in range(16):
+        for index_x in range(16):
+            num_layers = int(rng.integers(1, max_layers + 1))
+            tex_ids = rng.choice(num_textures, num_layers, replace=False)
+            alphas = make_layer_alphas(rng, num_layers)
+
+            mcly_data = b''
+            mcal_data = b''
+            for layer_id in range(num_layers):
+                flags = 0
+                alpha_offset = len(mcal_data)
+                if layer_id > 0:
+                    flags |= 0x100 # use alpha map
+                    alphamap_data = alphas[layer_id - 1]
+                    if alpha_format == "small":
+                        mcal_data += pack_small_alpha(alphamap_data)
+                    elif alpha_format == "big":
+                        mcal_data += alphamap_data.tobytes()
+                    else:
+                        flags |= 0x200 # compressed
+                        mcal_data += compress_alpha_map(alphamap_data)
+                mcly_data += struct.pack('4I', int(tex_ids[layer_id]), flags, alpha_offset, 0)
+
+            mcly_chunk = chunk(b'MCLY', mcly_data)
+            mcal_chunk = chunk(b'MCAL', mcal_data)
+            ofs_layer = 8 + MCNK_HEADER_SIZE
+            ofs_alpha = ofs_layer + len(mcly_chunk)
+            mcnk_flags = (1 << 15) if do_not_fix_alpha_map else 0
+            header = struct.pack('11I', mcnk_flags, index_x, index_y, num_layers, 0, 0, 0, ofs_layer, 0, ofs_alpha, len(mcal_chunk))
+            header += b'\x00' * (MCNK_HEADER_SIZE - len(header))
+
+            mcnk_chunk = chunk(b'MCNK', header + mcly_chunk + mcal_chunk)
+            mcin_entries.append(struct.pack('4I', mcnk_offset, len(mcnk_chunk), 0, 0))
+            mcnk_chunks.append(mcnk_chunk)
+            mcnk_offset += len(mcnk_chunk)
+
+    # MHDR offsets are relative to the start of MHDR data
+    mhdr_data = struct.pack('3I', 0, mcin_offset - 20, mtex_offset - 20) + b'\x00' * (mhdr_size - 12)
+    return (chunk(b'MVER', struct.pack('I', 18))
+            + chunk(b'MHDR', mhdr_data)
+            + mtex_chunk
+            + chunk(b'MCIN', b''.join(mcin_entries))
+            + b''.join(mcnk_chunks))
+
+def make_wdt(big_alpha=False, adt_coords=()):
+    """Return the bytes of a WDT, adt_coords lists the (x, y) of the ADTs flagged in MAIN."""
+    main_data = bytearray(64 * 64 * 8)
+    for x, y in adt_coords:
+        struct.pack_into('I', main_data, (y * 64 + x) * 8, 1)
+    mphd_data = struct.pack('8I', 0x04 if big_alpha else 0, 0, 0, 0, 0, 0, 0, 0)
+    return chunk(b'MVER', struct.pack('I', 18)) + chunk(b'MPHD', mphd_data) + chunk(b'MAIN', bytes(main_data))
+
+def write_map(folder, map_name, alpha_format="big", adt_count=4, num_textures=8, max_layers=4, seed=0):
+    """Write a WDT and adt_count ADTs of a synthetic map in folder, return the ADT paths."""
+    os.makedirs(folder, exist_ok=True)
+    adt_coords = [(32 + i % 8, 32 + i // 8) for i in range(adt_count)]
+    with open(os.path.join(folder, f"{map_name}.wdt"), 'wb') as f:
+        f.write(make_wdt(alpha_format != "small", adt_coords))
+
+    adt_paths = []
+    for i, (x, y) in enumerate(adt_coords):
+        adt_path = os.path.join(folder, f"{map_name}_{x}_{y}.adt")
+        with open(adt_path, 'wb') as f:
+            f.write(make_adt(alpha_format, num_textures, max_layers, seed + i))
+        adt_paths.append(adt_path)
+    return adt_paths
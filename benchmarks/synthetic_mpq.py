@@ -0,0 +1,151 @@
+"""Synthetic MPQ archives (format version 0), for benchmarks and for checking the MPQ reader.
+
+Files are given as (name, data, mode) and stored with the mode's layout:
+    "zlib"          zlib compressed sectors,
+    "bzip2"         bzip2 compressed sectors,
+    "raw"           stored as is, no sector table,
+    "single"        one zlib compressed unit, no sector table,
+    "crc"           zlib compressed sectors, with a sector checksums entry in the sector table,
+    "encrypted"     zlib compressed sectors and sector table encrypted with the file name key,
+    "fix_key"       same, with the key adjusted by block offset and file size (MPQ_FILE_FIX_KEY),
+    "encrypted_raw" uncompressed sectors encrypted with the file name key,
+    "single_fix_key" one zlib compressed unit encrypted with the adjusted key,
+    "delete"        delete marker hiding the file of earlier archives, data is ignored.
+Sectors which don't get smaller when compressed are stored as is, like the client tools do.
+"""
+import bz2
+import os
+import struct
+import sys
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from alphamaps.mpq import (COMPRESSION_BZIP2, COMPRESSION_ZLIB, HASH_FILE_KEY, HASH_NAME_A, HASH_NAME_B, HASH_TABLE_OFFSET,
+                           MPQ_FILE_COMPRESS, MPQ_FILE_DELETE_MARKER, MPQ_FILE_ENCRYPTED, MPQ_FILE_EXISTS, MPQ_FILE_FIX_KEY,
+                           MPQ_FILE_SECTOR_CRC, MPQ_FILE_SINGLE_UNIT, crypt_table, hash_string)
+
+MPQ_MODES = ("zlib", "bzip2", "raw", "single", "crc", "encrypted", "fix_key", "encrypted_raw", "single_fix_key", "delete")
+MPQ_HEADER_SIZE = 32
+
+mode_flags = {
+    "zlib": MPQ_FILE_COMPRESS,
+    "bzip2": MPQ_FILE_COMPRESS,
+    "raw": 0,
+    "single": MPQ_FILE_COMPRESS | MPQ_FILE_SINGLE_UNIT,
+    "crc": MPQ_FILE_COMPRESS | MPQ_FILE_SECTOR_CRC,
+    "encrypted": MPQ_FILE_COMPRESS | MPQ_FILE_ENCRYPTED,
+    "fix_key": MPQ_FILE_COMPRESS | MPQ_FILE_ENCRYPTED | MPQ_FILE_FIX_KEY,
+    "encrypted_raw": MPQ_FILE_ENCRYPTED,
+    "single_fix_key": MPQ_FILE_COMPRESS | MPQ_FILE_SINGLE_UNIT | MPQ_FILE_ENCRYPTED | MPQ_FILE_FIX_KEY,
+    "delete": MPQ_FILE_DELETE_MARKER,
+}
+
+
+def encrypt(data, key):
+    """Encrypt the whole 32 bit words of data, trailing bytes are left as is (the inverse of mpq.decrypt)."""
+    word_count = len(data) // 4
+    values = list(struct.unpack_from(f'<{word_count}I', data))
+    seed = 0xEEEEEEEE
+    for i, value in enumerate(values):
+        seed = (seed + crypt_table[0x400 + (key & 0xFF)]) & 0xFFFFFFFF
+        values[i] = (value ^ (key + seed)) & 0xFFFFFFFF
+        key = ((((~key & 0xFFFFFFFF) << 0x15) + 0x11111111) & 0xFFFFFFFF) | (key >> 0x0B)
+        seed = (value + seed + (seed << 5) + 3) & 0xFFFFFFFF
+    return struct.pack(f'<{word_count}I', *values) + bytes(data[word_count * 4:])
+
+def compress_sector(data, mode):
+    if mode == "bzip2":
+        compressed = bytes([COMPRESSION_BZIP2]) + bz2.compress(data)
+    else:
+        compressed = bytes([COMPRESSION_ZLIB]) + zlib.compress(data)
+    return compressed if len(compressed) < len(data) else data
+
+def file_key(name, offset, file_size, flags):
+    key = hash_string(name.replace('/', '\\').rsplit('\\', 1)[-1], HASH_FILE_KEY)
+    if flags & MPQ_FILE_FIX_KEY:
+        key = ((key + offset) ^ file_size) & 0xFFFFFFFF
+    return key
+
+def store_file(name, data, mode, offset, sector_size):
+    """Return (stored bytes, flags) of a file whose data starts at offset from the MPQ header."""
+    flags = mode_flags[mode] | MPQ_FILE_EXISTS
+    if mode == "delete":
+        return b'', flags
+    key = file_key(name, offset, len(data), flags) if flags & MPQ_FILE_ENCRYPTED else None
+
+    if flags & MPQ_FILE_SINGLE_UNIT:
+        stored = compress_sector(data, mode)
+        return (encrypt(stored, key) if key is not None else stored), flags
+
+    sectors = [data[i:i + sector_size] for i in range(0, len(data), sector_size)]
+    if not flags & MPQ_FILE_COMPRESS:
+        if key is not None:
+            sectors = [encrypt(sector, (key + i) & 0xFFFFFFFF) for i, sector in enumerate(sectors)]
+        return b''.join(sectors), flags
+
+    sectors = [compress_sector(sector, mode) for sector in sectors]
+    if key is not None:
+        sectors = [encrypt(sector, (key + i) & 0xFFFFFFFF) for i, sector in enumerate(sectors)]
+    if flags & MPQ_FILE_SECTOR_CRC:
+        sectors.append(struct.pack(f'<{len(sectors)}I', *(zlib.adler32(sector) for sector in sectors)))
+    offsets = [(len(sectors) + 1) * 4]
+    for sector in sectors:
+        offsets.append(offsets[-1] + len(sector))
+    sector_table = struct.pack(f'<{len(offsets)}I', *offsets)
+    if key is not None:
+        sector_table = encrypt(sector_table, (key - 1) & 0xFFFFFFFF)
+    return sector_table + b''.join(sectors), flags
+
+def make_mpq(files, sector_size_shift=3, prefix_size=0, user_data=False):
+    """Return the bytes of an MPQ archive holding files, a list of (name, data, mode).
+
+    prefix_size bytes (a multiple of 512) of other data are written before the
+    archive, user_data adds a user data block pointing at the header.
+    """
+    sector_size = 512 << sector_size_shift
+    body = bytearray()
+    blocks = []
+    for name, data, mode in files:
+        if mode not in MPQ_MODES:
+            raise ValueError(f"Unknown MPQ storage mode '{mode}', expected one of {MPQ_MODES}.")
+        offset = MPQ_HEADER_SIZE + len(body)
+        stored, flags = store_file(name, data, mode, offset, sector_size)
+        blocks.append((offset, len(stored), len(data) if mode != "delete" else 0, flags))
+        body += stored
+
+    # hash table with linear probing, its size a power of 2 larger than the file count
+    hash_table_entries = 16
+    while hash_table_entries < len(files) * 2:
+        hash_table_entries *= 2
+    hash_entries = [(0xFFFFFFFF, 0xFFFFFFFF, 0xFFFF, 0xFFFF, 0xFFFFFFFF)] * hash_table_entries
+    for block_index, (name, data, mode) in enumerate(files):
+        i = hash_string(name, HASH_TABLE_OFFSET) & (hash_table_entries - 1)
+        while hash_entries[i][4] != 0xFFFFFFFF:
+            i = (i + 1) & (hash_table_entries - 1)
+        hash_entries[i] = (hash_string(name, HASH_NAME_A), hash_string(name, HASH_NAME_B), 0, 0, block_index)
+
+    hash_table = encrypt(b''.join(struct.pack('<IIHHI', *entry) for entry in hash_entries),
+                         hash_string("(hash table)", HASH_FILE_KEY))
+    block_table = encrypt(b''.join(struct.pack('<4I', *block) for block in blocks),
+                          hash_string("(block table)", HASH_FILE_KEY))
+    hash_table_pos = MPQ_HEADER_SIZE + len(body)
+    block_table_pos = hash_table_pos + len(hash_table)
+    archive_size = block_table_pos + len(block_table)
+    header = struct.pack('<4sIIHHIIII', b'MPQ\x1a', MPQ_HEADER_SIZE, archive_size, 0, sector_size_shift,
+                         hash_table_pos, block_table_pos, hash_table_entries, len(blocks))
+
+    if prefix_size % 0x200:
+        raise ValueError(f"MPQ headers are aligned on 512 bytes, got a {prefix_size} bytes prefix.")
+    prefix = bytes(prefix_size)
+    if user_data:
+        # user data block of 512 bytes, the header follows it
+        prefix += struct.pack('<4sIII', b'MPQ\x1b', 0x200 - 16, 0x200, 16).ljust(0x200, b'\0')
+    return prefix + header + bytes(body) + hash_table + block_table
+
+def write_mpq(path, files, **kwargs):
+    """Write make_mpq(files, **kwargs) to path."""
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(make_mpq(files, **kwargs))